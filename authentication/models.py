@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import (
     BaseUserManager,
     AbstractBaseUser,
@@ -14,7 +14,7 @@ from django.conf import settings
 
 from django.dispatch import receiver
 from django.core.mail import send_mail
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from jwt import encode
 
 
@@ -233,3 +233,18 @@ def send_activation_email(sender, instance, **kwargs):
     email_from = settings.COMPANY_EMAIL
     receipient_list = [instance.email]
     send_mail( subject, message, email_from, receipient_list )
+
+
+@receiver(post_save, sender=CurrentRiderLocation, dispatch_uid="index_rider_location")
+@receiver(post_save, sender=RiderProfile, dispatch_uid="index_rider_profile")
+def index_rider(sender, instance, **kwargs):
+    from order.dispatch import update_rider_index
+    rider_profile = instance if sender is RiderProfile else instance.rider_profile
+    transaction.on_commit(lambda: update_rider_index(rider_profile))
+
+
+@receiver(post_delete, sender=RiderProfile, dispatch_uid="unindex_rider_profile")
+def unindex_rider(sender, instance, **kwargs):
+    from order.dispatch import get_rider_index
+    if instance.user_id:
+        transaction.on_commit(lambda: get_rider_index().remove(instance.user_id))
@@ -1,8 +1,184 @@
+import base64
+import binascii
+import json
+import math
+from collections import OrderedDict
+from datetime import date
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from django_filters.rest_framework import DjangoFilterBackend
 
 class CustomPageNumberPagination(pagination.PageNumberPagination):
-    page_size = 2
+    page_size = 20
     page_size_query_param = 'page_size'
     max_page_size = 100
     page_query_param = 'p'
+
+
+class KeysetPagination(pagination.BasePagination):
+    """
+    Keyset (seek) pagination. Each page continues strictly after the ordering
+    values of the last row of the previous page, so a cursor stays valid when
+    rows are inserted and a page costs one indexed query however deep it is.
+    The view sets `keyset_ordering` to fields ending with a unique one, e.g. ('-rating', '-id').
+    Rankings computed in Python page through `paginate_positions` instead.
+    """
+
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.prepare(request)
+        ordering = getattr(view, 'keyset_ordering', self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if self.position is not None:
+            position = self.clean_position(queryset.model, ordering, self.position)
+            queryset = queryset.filter(self.get_position_filter(ordering, position))
+
+        rows = list(queryset[:self.page_size + 1])
+        page = self.set_next_position(rows, lambda row: self.get_row_position(row, ordering))
+        return page
+
+    def paginate_positions(self, positions, request):
+        """
+        Paginate a list of position tuples sorted in ascending order.
+        Returns the positions that make up the requested page.
+        """
+        self.prepare(request)
+        if self.position is not None and positions:
+            position = self.check_position_types(self.position, positions[0])
+            positions = (item for item in positions if tuple(item) > position)
+
+        rows = []
+        for item in positions:
+            rows.append(item)
+            if len(rows) > self.page_size:
+                break
+        return self.set_next_position(rows, list)
+
+    def prepare(self, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.position = self.decode_cursor(request)
+        self.next_position = None
+
+    def clean_position(self, model, ordering, position):
+        """Convert the cursor values to the ordering fields' types, rejecting a tampered cursor."""
+        if len(position) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        values = []
+        for field, value in zip(ordering, position):
+            try:
+                value = model._meta.get_field(field.lstrip('-')).to_python(value)
+            except FieldDoesNotExist:
+                pass
+            except (ValidationError, TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+            if isinstance(value, Decimal) and not value.is_finite():
+                raise NotFound(self.invalid_cursor_message)
+            values.append(value)
+        return values
+
+    def check_position_types(self, position, example):
+        """Return the cursor as a tuple if it is comparable with the example position."""
+        if len(position) != len(example):
+            raise NotFound(self.invalid_cursor_message)
+        for value, expected in zip(position, example):
+            expected_type = str if isinstance(expected, str) else (int, float)
+            if not isinstance(value, expected_type):
+                raise NotFound(self.invalid_cursor_message)
+        return tuple(position)
+
+    def set_next_position(self, rows, get_position):
+        if len(rows) > self.page_size:
+            rows = rows[:self.page_size]
+            self.next_position = get_position(rows[-1])
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_row_position(self, row, ordering):
+        return [getattr(row, field.lstrip('-')) for field in ordering]
+
+    def get_position_filter(self, ordering, position):
+        """
+        Build the row-value comparison (a, b) > (x, y) as
+        a > x OR (a = x AND b > y), honouring each field's direction.
+        """
+        position_filter = Q()
+        equal = Q()
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            position_filter |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return position_filter
+
+    def encode_cursor(self, position):
+        values = [
+            str(value) if isinstance(value, Decimal)
+            else value.isoformat() if isinstance(value, date)
+            else value
+            for value in position
+        ]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or not position:
+            raise NotFound(self.invalid_cursor_message)
+        # Only the JSON scalars a cursor is encoded from, see encode_cursor.
+        if any(
+            isinstance(value, bool) or not isinstance(value, (str, int, float))
+            or isinstance(value, float) and not math.isfinite(value)
+            for value in position
+        ):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'results': schema,
+            },
+        }
@@ -0,0 +1,34 @@
+import codecs
+import csv
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class CSVReader(csv.DictReader):
+    """
+    Lazy iterator of the row dicts of a UTF-8 CSV byte stream, keyed by the
+    header row. Input that is not valid UTF-8 or CSV raises a ParseError.
+    """
+
+    def __init__(self, stream):
+        super().__init__(codecs.iterdecode(stream, 'utf-8-sig'))
+
+    def __next__(self):
+        try:
+            return super().__next__()
+        except UnicodeDecodeError:
+            raise ParseError('CSV must be UTF-8 encoded')
+        except csv.Error as error:
+            raise ParseError(f'CSV parse error - {error}')
+
+
+class CSVParser(BaseParser):
+    """
+    Parses a UTF-8 text/csv body into a CSVReader. Rows are read from the
+    request stream as they are consumed.
+    """
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return CSVReader(stream)
@@ -18,11 +18,43 @@ REJECTED = 'rejected'
 
 STATUSES = ((RECEIVED, RECEIVED), (ACCEPTED, ACCEPTED), (DISPATCHED, DISPATCHED), (DELIVERED, DELIVERED), (CANCELED, CANCELED), (REJECTED, REJECTED),)
 
+# Statuses an order may move to from each status
+STATUS_TRANSITIONS = {
+    RECEIVED: (ACCEPTED, REJECTED, CANCELED),
+    ACCEPTED: (DISPATCHED, CANCELED),
+    DISPATCHED: (DELIVERED,),
+    DELIVERED: (),
+    CANCELED: (),
+    REJECTED: (),
+}
+
+# Orders in these statuses are no longer tracked
+FINISHED_STATUSES = tuple(status for status, next_statuses in STATUS_TRANSITIONS.items() if not next_statuses)
+
+# A rider with an order in one of these statuses is not available for dispatch
+RIDER_BUSY_STATUSES = (ACCEPTED, DISPATCHED)
+DISPATCH_RADIUS = 10
+DISPATCH_CANDIDATES = 10
+
+DAILY = 'daily'
+WEEKLY = 'weekly'
+ROLLUP_PERIODS = ((DAILY, DAILY), (WEEKLY, WEEKLY),)
+
 USER_TYPES = (('customer', 'customer'), ('rider', 'rider'), ('pharmacist', 'pharmacist'))
 CUSTOMER = 'customer'
 PHARMACIST = 'pharmacist'
 RIDER = 'rider'
 
+# Who may move an order to each status, as the order's customer, assigned
+# rider or a pharmacist of its pharmacy.
+STATUS_CHANGED_BY = {
+    ACCEPTED: (PHARMACIST,),
+    REJECTED: (PHARMACIST,),
+    DISPATCHED: (PHARMACIST, RIDER),
+    DELIVERED: (PHARMACIST, RIDER),
+    CANCELED: (PHARMACIST, CUSTOMER),
+}
+
 BUSINESS_PERMIT = 'business_permit'
 ANNUAL_PRACTICE_LICENSE = 'annual_practice_license'
 PREMISES_REGISTRATION_LICENSE = 'premises_registration_license'
@@ -30,3 +62,14 @@ PREMISES_REGISTRATION_LICENSE = 'premises_registration_license'
 PHARMACY_LICENSES = ((BUSINESS_PERMIT, BUSINESS_PERMIT),
  (ANNUAL_PRACTICE_LICENSE, ANNUAL_PRACTICE_LICENSE), 
  (PREMISES_REGISTRATION_LICENSE, PREMISES_REGISTRATION_LICENSE))
+
+GEOHASH_PRECISION = 9
+DEFAULT_SEARCH_RADIUS = 10
+MAX_SEARCH_RADIUS = 100
+DEFAULT_NEAREST_LIMIT = 20
+MAX_NEAREST_LIMIT = 100
+
+HAVERSINE = 'haversine'
+EQUIRECTANGULAR = 'equirectangular'
+GEODESIC = 'geodesic'
+DEFAULT_DISTANCE_MODE = HAVERSINE
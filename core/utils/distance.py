@@ -0,0 +1,93 @@
+import numpy as np
+from geopy.distance import distance as geodesic_distance
+
+from core.utils.constants import DEFAULT_DISTANCE_MODE, EQUIRECTANGULAR, GEODESIC, HAVERSINE
+
+EARTH_RADIUS = 6371.0088
+
+# Relative error against the geodesic on the WGS-84 ellipsoid. The
+# equirectangular bound holds for the city-scale radii used for searches.
+TOLERANCES = {
+    HAVERSINE: 0.006,
+    EQUIRECTANGULAR: 0.01,
+    GEODESIC: 0,
+}
+
+
+def geodesic(origin, coordinate):
+    """Exact distance in km between two points on the WGS-84 ellipsoid."""
+    return geodesic_distance(origin, coordinate).km
+
+
+def batch_distance(origin, coordinates, mode=DEFAULT_DISTANCE_MODE):
+    """
+    Return the distances in km from origin to each of N coordinates as a NumPy array.
+    coordinates is anything np.asarray accepts with shape (N, 2) of (lat, long).
+    mode:
+        - haversine: great circle distance, accurate to within 0.5%
+        - equirectangular: flat projection, cheaper and fine for short distances
+        - geodesic: exact, but computed one pair at a time
+    """
+    coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+
+    if mode == GEODESIC:
+        return np.fromiter(
+            (geodesic(origin, coordinate) for coordinate in coordinates),
+            dtype=float,
+            count=len(coordinates),
+        )
+
+    lat1, long1 = np.radians(float(origin[0])), np.radians(float(origin[1]))
+    lat2, long2 = np.radians(coordinates[:, 0]), np.radians(coordinates[:, 1])
+    delta_lat = lat2 - lat1
+    delta_long = long2 - long1
+
+    if mode == EQUIRECTANGULAR:
+        x = delta_long * np.cos((lat1 + lat2) / 2)
+        return EARTH_RADIUS * np.hypot(x, delta_lat)
+
+    if mode == HAVERSINE:
+        a = np.sin(delta_lat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(delta_long / 2) ** 2
+        return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+    raise ValueError(f'Unknown distance mode {mode}')
+
+
+def nearest(origin, coordinates, k, radius=None, mode=DEFAULT_DISTANCE_MODE, exact=True):
+    """
+    Return [(index, distance)] for the k coordinates closest to origin, nearest first.
+    The distances are computed in one vectorized pass. With exact set, the
+    final top-k is re-ranked with the exact geodesic; every candidate whose
+    approximate distance is within the approximation error of the k-th one is
+    re-checked so the exact ranking cannot miss a closer point.
+    """
+    distances = batch_distance(origin, coordinates, mode=mode)
+    error = TOLERANCES[mode]
+
+    if radius is not None:
+        limit = radius * (1 + error) if exact and mode != GEODESIC else radius
+        candidates = np.flatnonzero(distances <= limit)
+    else:
+        candidates = np.arange(len(distances))
+
+    if not len(candidates) or k <= 0:
+        return []
+
+    if len(candidates) > k:
+        top = candidates[np.argpartition(distances[candidates], k - 1)[:k]]
+        if exact and mode != GEODESIC:
+            cutoff = distances[top].max() * (1 + error) / (1 - error)
+            candidates = candidates[distances[candidates] <= cutoff]
+        else:
+            candidates = top
+
+    if exact and mode != GEODESIC:
+        points = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+        results = [(int(index), geodesic(origin, points[index])) for index in candidates]
+    else:
+        results = [(int(index), float(distances[index])) for index in candidates]
+
+    if radius is not None:
+        results = [result for result in results if result[1] <= radius]
+    results.sort(key=lambda result: result[1])
+    return results[:k]
@@ -0,0 +1,86 @@
+import math
+
+from core.utils.constants import GEOHASH_PRECISION
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+KM_PER_DEGREE = 111.32
+
+
+def encode(lat, long, precision=GEOHASH_PRECISION):
+    """
+    Encode a coordinate into a geohash of the given precision.
+    Points sharing a geohash prefix lie in the same grid cell, so a prefix
+    match on an indexed geohash column is a cheap spatial prefilter.
+    """
+    lat_range = [-90.0, 90.0]
+    long_range = [-180.0, 180.0]
+    lat, long = float(lat), float(long)
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+
+    while len(geohash) < precision:
+        value, interval = (long, long_range) if even else (lat, lat_range)
+        mid = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            interval[0] = mid
+        else:
+            interval[1] = mid
+        even = not even
+        bit_count += 1
+
+        if bit_count == 5:
+            geohash.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return ''.join(geohash)
+
+
+def cell_size(precision):
+    """Return the (height, width) in degrees of a geohash cell."""
+    total_bits = precision * 5
+    long_bits = math.ceil(total_bits / 2)
+    lat_bits = total_bits - long_bits
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** long_bits
+
+
+def bounding_box(lat, long, radius):
+    """Return (min_lat, max_lat, min_long, max_long) enclosing a radius in km."""
+    lat, long = float(lat), float(long)
+    delta_lat = radius / KM_PER_DEGREE
+    cos_lat = math.cos(math.radians(lat))
+    delta_long = 180.0 if cos_lat < 1e-6 else min(radius / (KM_PER_DEGREE * cos_lat), 180.0)
+
+    return (
+        max(lat - delta_lat, -90.0),
+        min(lat + delta_lat, 90.0),
+        max(long - delta_long, -180.0),
+        min(long + delta_long, 180.0),
+    )
+
+
+def covering_cells(box):
+    """
+    Return the geohash prefixes that together cover a bounding box.
+    The precision is the finest one whose cells are at least as large as the
+    box, so the box touches at most four cells: the ones holding its corners.
+    """
+    min_lat, max_lat, min_long, max_long = box
+    precision = GEOHASH_PRECISION
+
+    while precision > 1:
+        height, width = cell_size(precision)
+        if height >= max_lat - min_lat and width >= max_long - min_long:
+            break
+        precision -= 1
+
+    return {
+        encode(lat, long, precision)
+        for lat in (min_lat, max_lat)
+        for long in (min_long, max_long)
+    }
@@ -1,41 +1,68 @@
-from geopy.distance import distance
 import random
 import string
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
 from rest_framework.exceptions import ValidationError
 
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
+from django.utils.dateparse import parse_date
 import six
-from medzako.celery import app
 
 def raise_validation_error(message=None):
     raise ValidationError(message)
 
 
-def get_coordinate_distance(cood1, cood2):
-    return distance(cood1, cood2).km
+def get_coordinates(query_params):
+    try:
+        lat = Decimal(query_params.get('lat'))
+        long = Decimal(query_params.get('long'))
+    except (TypeError, InvalidOperation):
+        raise_validation_error({'detail': 'Ensure the latitude and the longitude are specified decimals'})
+    if not (lat.is_finite() and long.is_finite() and -90 <= lat <= 90 and -180 <= long <= 180):
+        raise_validation_error({'detail': 'Ensure the latitude is between -90 and 90 and the longitude between -180 and 180'})
+    return lat, long
 
 
-def add_distance_to_pharmacy(pharmacy_dict, cood2):
-    pharmacy_dict = dict(pharmacy_dict)
-    lat1 = Decimal(pharmacy_dict['location_lat'])
-    long1 = Decimal(pharmacy_dict['location_long'])
-    distance = get_coordinate_distance((lat1, long1), cood2)
-    pharmacy_dict['distance'] = distance
-    return pharmacy_dict
+def get_bounded_number(query_params, name, default, maximum, cast=int):
+    value = query_params.get(name, default)
+    try:
+        value = cast(value)
+    except (TypeError, ValueError):
+        raise_validation_error({name: 'Ensure this value is a number'})
+    if not value > 0:
+        raise_validation_error({name: 'Ensure this value is greater than 0'})
+    return min(value, maximum)
 
 
-def generate_random_string(length):
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k = length))
+def get_date_range(query_params):
+    """The optional from and to dates (YYYY-MM-DD) of a request, inclusive."""
+    dates = []
+    for name in ('from', 'to'):
+        value = query_params.get(name)
+        try:
+            date = parse_date(value) if value else None
+        except ValueError:
+            date = None
+        if value and date is None:
+            raise_validation_error({name: 'Enter a valid date in the YYYY-MM-DD format'})
+        dates.append(date)
+    return dates
+
 
-app.task()
-def get_rider(destination, rider_locations, maximum_radius):
-    riders_distances = [(rider_location.rider, get_coordinate_distance((rider_location.lat, rider_location.long), destination)) for rider_location in rider_locations]
-    riders_distances.sort(key=lambda x: x[1])
-    if riders_distances[0][1] < maximum_radius:
-        return riders_distances[0]
+def optimize_queryset(queryset, serializer_class):
+    """Apply the select_related and prefetch_related declared on the serializer's Meta."""
+    meta = getattr(serializer_class, 'Meta', None)
+    select_related = getattr(meta, 'select_related', ())
+    prefetch_related = getattr(meta, 'prefetch_related', ())
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*prefetch_related)
+    return queryset
 
 
+def generate_random_string(length):
+    return ''.join(random.choices(string.ascii_uppercase + string.digits, k = length))
+
 class TokenGenerator(PasswordResetTokenGenerator):
 
     def _make_hash_value(self, user, timestamp):
@@ -0,0 +1,60 @@
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from .models import CatalogVersion
+
+CATALOG_VERSION_ID = 1
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def get_catalog_version():
+    """Return the catalog version row, a single primary key lookup."""
+    catalog_version, _ = CatalogVersion.objects.get_or_create(pk=CATALOG_VERSION_ID)
+    return catalog_version
+
+
+def bump_catalog_version():
+    """Invalidate every cached catalog response. Call it after bulk writes, which skip signals."""
+    updated = CatalogVersion.objects.filter(pk=CATALOG_VERSION_ID).update(
+        version=F('version') + 1,
+        updated_at=timezone.now(),
+    )
+    if not updated:
+        get_catalog_version()
+
+
+class CachedCatalogMixin:
+    """
+    Serves list responses of catalog data from the cache and answers
+    conditional GETs with 304 Not Modified.
+    The ETag and cache key carry the catalog version, so any medication or
+    category write makes every cached copy unreachable. That also holds
+    with a per process cache. Last-Modified is the time of the last write.
+    """
+
+    catalog_cache_timeout = CATALOG_CACHE_TIMEOUT
+
+    def list(self, request, *args, **kwargs):
+        catalog_version = get_catalog_version()
+        etag = f'"catalog-{catalog_version.version}"'
+        last_modified = int(catalog_version.updated_at.timestamp())
+
+        not_modified = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        key = f'catalog:{catalog_version.version}:{type(self).__name__}:{request.get_full_path()}'
+        data = cache.get(key)
+        if data is None:
+            data = super().list(request, *args, **kwargs).data
+            cache.set(key, data, self.catalog_cache_timeout)
+
+        return Response(data, headers={
+            'ETag': etag,
+            'Last-Modified': http_date(last_modified),
+            'Cache-Control': 'private, no-cache',
+        })
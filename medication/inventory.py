@@ -0,0 +1,99 @@
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import models, serializers
+
+STOCK_CHUNK_SIZE = 500
+STOCK_CHUNK_ATTEMPTS = 3
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def validate_stock_rows(chunk):
+    """
+    Validate a chunk of (row number, row) pairs.
+    Returns the valid rows keyed by medication id and the errors of the rest.
+    When a medication appears more than once the last row wins and the
+    earlier ones are reported.
+    """
+    valid = {}
+    errors = []
+    for row_number, row in chunk:
+        serializer = serializers.BulkStockRowSerializer(data=row)
+        if serializer.is_valid():
+            medication_id = serializer.validated_data['medication']
+            if medication_id in valid:
+                replaced_row, _ = valid[medication_id]
+                errors.append({'row': replaced_row, 'errors': {'medication': [f'Replaced by row {row_number} for the same medication']}})
+            valid[medication_id] = (row_number, serializer.validated_data)
+        else:
+            errors.append({'row': row_number, 'errors': serializer.errors})
+
+    known = set(models.Medication.objects.filter(id__in=valid).values_list('id', flat=True))
+    for medication_id in set(valid) - known:
+        row_number, _ = valid.pop(medication_id)
+        errors.append({'row': row_number, 'errors': {'medication': [f'Invalid pk "{medication_id}" - object does not exist.']}})
+    return valid, errors
+
+
+def write_stock_chunk(pharmacy, valid):
+    """Update the stock of the medications the pharmacy already has and create the rest. Returns (created, updated)."""
+    valid = dict(valid)
+    existing = models.PharmacyStock.objects.filter(pharmacy=pharmacy, medication_id__in=valid).only('id', 'medication_id')
+    now = timezone.now()
+    to_update = []
+    for stock in existing:
+        _, data = valid.pop(stock.medication_id)
+        stock.price = data['price']
+        stock.in_stock = data['in_stock']
+        stock.updated_at = now
+        to_update.append(stock)
+    to_create = [
+        models.PharmacyStock(pharmacy=pharmacy, medication_id=medication_id, price=data['price'], in_stock=data['in_stock'])
+        for medication_id, (_, data) in valid.items()
+    ]
+
+    models.PharmacyStock.objects.bulk_update(to_update, ['price', 'in_stock', 'updated_at'])
+    models.PharmacyStock.objects.bulk_create(to_create)
+    return len(to_create), len(to_update)
+
+
+def upsert_stock(pharmacy, rows, chunk_size=STOCK_CHUNK_SIZE):
+    """
+    Create or update the pharmacy's stock from an iterable of
+    {medication, price, in_stock} rows. Each chunk costs a fixed number of
+    queries: one to check the medications, one to load the existing stock,
+    one bulk update and one bulk insert. Invalid rows are skipped and reported.
+    A chunk that races a concurrent upload creating the same stock is
+    retried, its conflicting rows then being updates.
+    """
+    created = updated = 0
+    errors = []
+
+    with transaction.atomic():
+        for chunk in chunked(enumerate(rows, start=1), chunk_size):
+            valid, chunk_errors = validate_stock_rows(chunk)
+            errors.extend(chunk_errors)
+
+            for attempt in range(STOCK_CHUNK_ATTEMPTS):
+                try:
+                    with transaction.atomic():
+                        chunk_created, chunk_updated = write_stock_chunk(pharmacy, valid)
+                    break
+                except IntegrityError:
+                    if attempt == STOCK_CHUNK_ATTEMPTS - 1:
+                        raise
+            created += chunk_created
+            updated += chunk_updated
+
+    errors.sort(key=lambda error: error['row'])
+    return {'created': created, 'updated': updated, 'errors': errors}
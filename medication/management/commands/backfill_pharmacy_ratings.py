@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce
+
+from medication.models import Pharmacy
+
+
+RATING_FIELDS = ['rating', 'rating_sum', 'rating_count']
+
+
+class Command(BaseCommand):
+    help = 'Recompute the rating counters and average of every pharmacy from its ratings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        pharmacies = (
+            Pharmacy.objects
+            .annotate(total=Coalesce(Sum('ratings__rating'), 0), count=Count('ratings'))
+            .only('id')
+            .order_by('id')
+        )
+
+        updated = []
+        with transaction.atomic():
+            for pharmacy in pharmacies.iterator(chunk_size=batch_size):
+                pharmacy.rating_sum = pharmacy.total
+                pharmacy.rating_count = pharmacy.count
+                pharmacy.rating = pharmacy.get_rating
+                updated.append(pharmacy)
+                if len(updated) >= batch_size:
+                    Pharmacy.objects.bulk_update(updated, RATING_FIELDS)
+                    updated = []
+            Pharmacy.objects.bulk_update(updated, RATING_FIELDS)
+
+        self.stdout.write(self.style.SUCCESS('Pharmacy ratings recomputed'))
@@ -0,0 +1,134 @@
+import csv
+import json
+import os
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.utils.constants import MEDICATION_TYPE
+from medication.cache import bump_catalog_version
+from medication.inventory import chunked
+from medication.models import Category, ImportCheckpoint, Medication
+
+MEDICATION_FIELDS = ('name', 'scientific_name', 'description', 'usage', 'side_effects', 'precautions', 'type', 'measurement', 'image')
+MEDICATION_TYPES = {key for key, _ in MEDICATION_TYPE}
+CSV = 'csv'
+JSONL = 'jsonl'
+
+
+class Command(BaseCommand):
+    help = (
+        'Import medications from a CSV or JSONL file. Columns: name, type, category '
+        'and optionally scientific_name, description, usage, side_effects, precautions, '
+        'measurement, image. Unknown categories are created. The file is streamed and '
+        'a checkpoint is saved with every batch so an interrupted import resumes '
+        'where it stopped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=[CSV, JSONL], help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--checkpoint', help='Checkpoint name, defaults to the absolute path of the file')
+        parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if file_format not in (CSV, JSONL):
+            raise CommandError('Pass --format csv or --format jsonl')
+        if not os.path.exists(path):
+            raise CommandError(f'{path} does not exist')
+
+        self.checkpoint_name = options['checkpoint'] or os.path.abspath(path)
+        start_after = 0 if options['restart'] else self.read_checkpoint()
+        if start_after:
+            self.stdout.write(f'Resuming after row {start_after}')
+
+        self.categories = dict(Category.objects.values_list('name', 'id'))
+        rows = self.read_rows(path, file_format)
+        rows = ((row_number, row) for row_number, row in rows if row_number > start_after)
+        medications = self.build_medications(rows)
+
+        imported = skipped = 0
+        started = time.monotonic()
+        for batch in chunked(medications, options['batch_size']):
+            last_row = batch[-1][0]
+            valid = [medication for _, medication in batch if medication is not None]
+            with transaction.atomic():
+                Medication.objects.bulk_create(valid)
+                bump_catalog_version()
+                self.write_checkpoint(last_row)
+
+            imported += len(valid)
+            skipped += len(batch) - len(valid)
+            rate = imported / max(time.monotonic() - started, 1e-9)
+            self.stdout.write(f'Row {last_row}: {imported} imported, {skipped} skipped, {rate:.0f} rows/s')
+
+        self.stdout.write(self.style.SUCCESS(f'Imported {imported} medications, skipped {skipped} rows'))
+
+    def read_rows(self, path, file_format):
+        """Yield (row number, row dict) one line at a time."""
+        with open(path, newline='', encoding='utf-8-sig') as catalog:
+            if file_format == CSV:
+                yield from enumerate(csv.DictReader(catalog), start=1)
+                return
+            for row_number, line in enumerate(catalog, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield row_number, json.loads(line)
+                except ValueError:
+                    yield row_number, None
+
+    def build_medications(self, rows):
+        """Yield (row number, unsaved Medication or None for an invalid row)."""
+        for row_number, row in rows:
+            error = self.validate(row)
+            if error:
+                self.stderr.write(f'Row {row_number}: {error}')
+                yield row_number, None
+                continue
+
+            fields = {field: row[field] for field in MEDICATION_FIELDS if row.get(field) not in (None, '')}
+            yield row_number, Medication(category_id=self.get_category_id(row.get('category')), **fields)
+
+    def validate(self, row):
+        if not isinstance(row, dict):
+            return 'not a JSON object'
+        if not row.get('name'):
+            return 'name is required'
+        if row.get('type') not in MEDICATION_TYPES:
+            return f'type must be one of {", ".join(sorted(MEDICATION_TYPES))}'
+        if not isinstance(row.get('category') or '', str):
+            return 'category must be a name'
+
+        # The model fields' own checks, so a value the database would reject, e.g.
+        # one over max_length, skips the row instead of aborting its batch.
+        values = [(Medication._meta.get_field(field), row.get(field)) for field in MEDICATION_FIELDS]
+        values.append((Category._meta.get_field('name'), row.get('category')))
+        for field, value in values:
+            if value in (None, ''):
+                continue
+            try:
+                field.clean(value, None)
+            except ValidationError as error:
+                name = 'category' if field.model is Category else field.name
+                return f'{name}: {" ".join(error.messages)}'
+        return None
+
+    def get_category_id(self, name):
+        if not name:
+            return None
+        if name not in self.categories:
+            self.categories[name] = Category.objects.create(name=name).id
+        return self.categories[name]
+
+    def read_checkpoint(self):
+        checkpoint = ImportCheckpoint.objects.filter(name=self.checkpoint_name).values_list('last_row', flat=True).first()
+        return checkpoint or 0
+
+    def write_checkpoint(self, row_number):
+        ImportCheckpoint.objects.update_or_create(name=self.checkpoint_name, defaults={'last_row': row_number})
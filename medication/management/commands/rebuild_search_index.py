@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from medication.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = (
+        'Create the medication search index if it is missing and repopulate it. '
+        'On SQLite, run it after any migration that rebuilds the medication table.'
+    )
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        backend.install()
+        backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Search index rebuilt with {type(backend).__name__}'))
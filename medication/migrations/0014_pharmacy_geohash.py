@@ -0,0 +1,29 @@
+# Generated by Django 3.2.7 on 2026-10-18 15:32
+
+from django.db import migrations, models
+
+from core.utils import geohash
+
+
+def backfill_geohash(apps, schema_editor):
+    Pharmacy = apps.get_model('medication', 'Pharmacy')
+    pharmacies = list(Pharmacy.objects.only('location_lat', 'location_long'))
+    for pharmacy in pharmacies:
+        pharmacy.geohash = geohash.encode(pharmacy.location_lat, pharmacy.location_long)
+    Pharmacy.objects.bulk_update(pharmacies, ['geohash'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medication', '0013_medication_measurement'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pharmacy',
+            name='geohash',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=12),
+        ),
+        migrations.RunPython(backfill_geohash, migrations.RunPython.noop),
+    ]
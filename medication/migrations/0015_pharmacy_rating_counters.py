@@ -0,0 +1,34 @@
+# Generated by Django 3.2.7 on 2026-10-18 15:35
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medication', '0014_pharmacy_geohash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pharmacy',
+            name='rating_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='pharmacy',
+            name='rating_sum',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='pharmacy',
+            name='rating',
+            field=models.DecimalField(decimal_places=1, default=0, max_digits=2),
+        ),
+        migrations.AlterField(
+            model_name='rating',
+            name='rating',
+            field=models.IntegerField(validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(5)]),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.7 on 2026-10-18 15:50
+
+from django.db import migrations
+
+from medication.search import get_search_backend
+
+
+def install_search_index(apps, schema_editor):
+    get_search_backend().install()
+
+
+def uninstall_search_index(apps, schema_editor):
+    get_search_backend().uninstall()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medication', '0015_pharmacy_rating_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.7 on 2026-10-18 15:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medication', '0016_medication_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pharmacystock',
+            index=models.Index(fields=['pharmacy', 'in_stock'], name='medication__pharmac_bce0b0_idx'),
+        ),
+    ]
@@ -1,12 +1,39 @@
 from decimal import Decimal
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.db.models import DecimalField, F, FloatField
+from django.db.models.functions import Cast, Coalesce, NullIf
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
 from cloudinary.models import CloudinaryField
+from core.utils import geohash
 from core.utils.constants import MEDICATION_TYPE
 
 from core.utils.validators import validate_phone_number
 from core.models import AbstractBaseModel
 
 
+class PharmacyQuerySet(models.QuerySet):
+
+    def near(self, lat, long, radius):
+        """
+        Narrow down to pharmacies inside the bounding box of a radius(km).
+        The geohash prefixes cut the search to a few index ranges and the
+        coordinate ranges drop the parts of those cells outside the box.
+        """
+        box = geohash.bounding_box(lat, long, radius)
+        cells = models.Q()
+        for cell in geohash.covering_cells(box):
+            cells |= models.Q(geohash__startswith=cell)
+
+        min_lat, max_lat, min_long, max_long = box
+        return self.filter(
+            cells,
+            location_lat__range=(Decimal(str(min_lat)), Decimal(str(max_lat))),
+            location_long__range=(Decimal(str(min_long)), Decimal(str(max_long))),
+        )
+
+
 class Pharmacy(AbstractBaseModel):
     name = models.CharField(max_length=100)
     location_lat = models.DecimalField(max_digits=45, decimal_places=40)
@@ -14,23 +41,46 @@ class Pharmacy(AbstractBaseModel):
     contact_no = models.CharField(unique=True, max_length=50, validators=[validate_phone_number])
     location_name = models.CharField(max_length=50, null=True)
     image = CloudinaryField('image')
-    rating = models.DecimalField(default=0, decimal_places=1, max_digits=1)
+    rating = models.DecimalField(default=0, decimal_places=1, max_digits=2)
+    rating_sum = models.IntegerField(default=0)
+    rating_count = models.IntegerField(default=0)
     completed_orders = models.IntegerField(default=0)
+    geohash = models.CharField(max_length=12, db_index=True, editable=False, default='')
+
+    # Only ever changed through F() updates, see `save`.
+    COUNTER_FIELDS = ('rating', 'rating_sum', 'rating_count', 'completed_orders')
+
+    objects = PharmacyQuerySet.as_manager()
 
     @property
     def get_rating(self):
-        ratings = self.ratings.all()
-        total_rating = 0
-
-        for rating in ratings:
-            total_rating += rating.rating
-        if ratings:
-            rating = total_rating/len(ratings)
-            return Decimal(round(rating, 1))
+        if self.rating_count:
+            return Decimal(self.rating_sum / self.rating_count).quantize(Decimal('0.1'))
         return 0
 
+    @classmethod
+    def add_rating(cls, pharmacy_id, rating, count):
+        """
+        Adjust the rating counters of a pharmacy and refresh its average in one UPDATE.
+        The SET expressions all read the row before the update, hence the repeated deltas.
+        """
+        rating_sum = F('rating_sum') + rating
+        rating_count = F('rating_count') + count
+        average = Cast(rating_sum, FloatField()) / NullIf(rating_count, 0)
+        cls.objects.filter(pk=pharmacy_id).update(
+            rating_sum=rating_sum,
+            rating_count=rating_count,
+            rating=Coalesce(average, 0, output_field=DecimalField(max_digits=2, decimal_places=1)),
+        )
+
     def save(self, *args, **kwargs):
-        self.rating = self.get_rating
+        self.geohash = geohash.encode(self.location_lat, self.location_long)
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # Saving a stale copy must not overwrite concurrent counter updates.
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
         return super().save(*args, **kwargs)
 
     def __str__(self):
@@ -59,6 +109,23 @@ class Medication(AbstractBaseModel):
         return self.name
 
 
+class CatalogVersion(AbstractBaseModel):
+    """
+    Single row counter bumped on every medication or category write.
+    Cached catalog responses are keyed by it, see medication.cache.
+    """
+    version = models.PositiveIntegerField(default=0)
+
+
+class ImportCheckpoint(AbstractBaseModel):
+    """
+    Last row of a catalog file imported by import_catalog. It is saved in the
+    transaction of each batch, so a resumed import neither skips nor repeats rows.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    last_row = models.PositiveIntegerField(default=0)
+
+
 class Category(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
@@ -89,6 +156,9 @@ class PharmacyStock(AbstractBaseModel):
 
     class Meta:
         unique_together = ['medication', 'pharmacy']
+        indexes = [
+            models.Index(fields=['pharmacy', 'in_stock']),
+        ]
 
 
 class Rating(AbstractBaseModel):
@@ -102,4 +172,37 @@ class Rating(AbstractBaseModel):
         related_name='rating',
         on_delete=models.CASCADE
     )
-    rating = models.IntegerField()
+    rating = models.IntegerField(validators=[MinValueValidator(1), MaxValueValidator(5)])
+
+
+@receiver(pre_save, sender=Rating, dispatch_uid="remember_previous_rating")
+def remember_previous_rating(sender, instance, **kwargs):
+    instance._previous_rating = None
+    if instance.pk:
+        instance._previous_rating = sender.objects.filter(pk=instance.pk).values_list('pharmacy_id', 'rating').first()
+
+
+@receiver(post_save, sender=Rating, dispatch_uid="count_saved_rating")
+def count_saved_rating(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_rating', None)
+    if created or previous is None:
+        Pharmacy.add_rating(instance.pharmacy_id, instance.rating, 1)
+    elif previous[0] == instance.pharmacy_id:
+        Pharmacy.add_rating(instance.pharmacy_id, instance.rating - previous[1], 0)
+    else:
+        Pharmacy.add_rating(previous[0], -previous[1], -1)
+        Pharmacy.add_rating(instance.pharmacy_id, instance.rating, 1)
+
+
+@receiver(post_delete, sender=Rating, dispatch_uid="uncount_deleted_rating")
+def uncount_deleted_rating(sender, instance, **kwargs):
+    Pharmacy.add_rating(instance.pharmacy_id, -instance.rating, -1)
+
+
+@receiver(post_save, sender=Medication, dispatch_uid="bump_catalog_version_medication_saved")
+@receiver(post_delete, sender=Medication, dispatch_uid="bump_catalog_version_medication_deleted")
+@receiver(post_save, sender=Category, dispatch_uid="bump_catalog_version_category_saved")
+@receiver(post_delete, sender=Category, dispatch_uid="bump_catalog_version_category_deleted")
+def bump_catalog_version(sender, **kwargs):
+    from .cache import bump_catalog_version
+    bump_catalog_version()
@@ -0,0 +1,220 @@
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, F, FloatField, Func, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.utils import OperationalError
+from django.utils.module_loading import import_string
+from rest_framework import filters
+
+MEDICATION_TABLE = 'medication_medication'
+FTS_TABLE = 'medication_medication_fts'
+SEARCH_FIELDS = ('name', 'scientific_name')
+
+
+def get_terms(query):
+    """Split a search query into lower case words, dropping any operator characters."""
+    return re.findall(r'\w+', query.lower())
+
+
+class BaseSearchBackend:
+    """
+    A search backend filters a queryset down to the medications matching a
+    query and annotates each row with a `search_rank`, higher being more relevant.
+    `prefix` is the path to the medication from the queryset's model, e.g. 'medication__'.
+    """
+
+    def search(self, queryset, query, prefix=''):
+        raise NotImplementedError
+
+    def install(self):
+        """Create the index structures. Safe to run more than once."""
+
+    def uninstall(self):
+        """Drop the index structures."""
+
+    def rebuild(self):
+        """Repopulate the index from the medication table."""
+
+
+class LikeSearchBackend(BaseSearchBackend):
+    """Unindexed fallback that matches every term anywhere in the name or scientific name."""
+
+    def search(self, queryset, query, prefix=''):
+        terms = get_terms(query)
+        for term in terms:
+            term_filter = Q()
+            for field in SEARCH_FIELDS:
+                term_filter |= Q(**{f'{prefix}{field}__icontains': term})
+            queryset = queryset.filter(term_filter)
+
+        search_rank = Case(
+            When(**{f'{prefix}name__istartswith': terms[0]}, then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+        return queryset.annotate(search_rank=search_rank).order_by('-search_rank', f'{prefix}name', f'{prefix}id')
+
+
+class FTSRank(Func):
+    """
+    bm25 rank of a row for an FTS5 match, negated so that higher is better.
+    Takes the match expression and the medication id.
+    """
+    template = f'-(SELECT rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %(expressions)s)'
+    arg_joiner = ' AND rowid = '
+    output_field = FloatField()
+
+
+class SqliteSearchBackend(BaseSearchBackend):
+    """
+    SQLite FTS5 external content table over the medication names, kept in
+    sync by triggers. Every term is matched as a prefix.
+    """
+
+    INSTALL_SQL = (
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+            name, scientific_name,
+            content='{MEDICATION_TABLE}', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )""",
+        f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON {MEDICATION_TABLE} BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, name, scientific_name) VALUES (new.id, new.name, new.scientific_name);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON {MEDICATION_TABLE} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, scientific_name) VALUES ('delete', old.id, old.name, old.scientific_name);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF name, scientific_name ON {MEDICATION_TABLE} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, scientific_name) VALUES ('delete', old.id, old.name, old.scientific_name);
+            INSERT INTO {FTS_TABLE}(rowid, name, scientific_name) VALUES (new.id, new.name, new.scientific_name);
+        END""",
+    )
+    UNINSTALL_SQL = (
+        f'DROP TRIGGER IF EXISTS {FTS_TABLE}_insert',
+        f'DROP TRIGGER IF EXISTS {FTS_TABLE}_delete',
+        f'DROP TRIGGER IF EXISTS {FTS_TABLE}_update',
+        f'DROP TABLE IF EXISTS {FTS_TABLE}',
+    )
+
+    @staticmethod
+    def is_available():
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA compile_options')
+            return ('ENABLE_FTS5',) in cursor.fetchall()
+
+    def search(self, queryset, query, prefix=''):
+        match = ' '.join(f'"{term}"*' for term in get_terms(query))
+        matches = RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match])
+        return (
+            queryset
+            .filter(**{f'{prefix}id__in': matches})
+            .annotate(search_rank=FTSRank(Value(match), F(f'{prefix}id')))
+            .order_by('-search_rank', f'{prefix}id')
+        )
+
+    def install(self):
+        with connection.cursor() as cursor:
+            for sql in self.INSTALL_SQL:
+                cursor.execute(sql)
+        self.rebuild()
+
+    def uninstall(self):
+        with connection.cursor() as cursor:
+            for sql in self.UNINSTALL_SQL:
+                cursor.execute(sql)
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+class SearchDocument(Func):
+    """The tsvector the full text index is built on. Must match DOCUMENT_SQL."""
+    template = "to_tsvector('simple'::regconfig, COALESCE(%(expressions)s, ''))"
+    arg_joiner = ", '') || ' ' || COALESCE("
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    PostgreSQL full text search over a GIN expression index, plus pg_trgm
+    indexes so misspelt names still match by trigram similarity.
+    """
+
+    DOCUMENT_SQL = "to_tsvector('simple'::regconfig, COALESCE(name, '') || ' ' || COALESCE(scientific_name, ''))"
+    INDEXES = {
+        'medication_search_document_idx': f'USING gin ({DOCUMENT_SQL})',
+        'medication_name_trgm_idx': 'USING gin (name gin_trgm_ops)',
+        'medication_scientific_name_trgm_idx': 'USING gin (scientific_name gin_trgm_ops)',
+    }
+
+    def search(self, queryset, query, prefix=''):
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField, TrigramSimilarity
+
+        terms = get_terms(query)
+        search_query = SearchQuery(' & '.join(f'{term}:*' for term in terms), config='simple', search_type='raw')
+        document = SearchDocument(*(F(f'{prefix}{field}') for field in SEARCH_FIELDS), output_field=SearchVectorField())
+        query = ' '.join(terms)
+
+        return (
+            queryset
+            .alias(search_document=document)
+            .filter(
+                Q(search_document=search_query)
+                | Q(**{f'{prefix}name__trigram_similar': query})
+                | Q(**{f'{prefix}scientific_name__trigram_similar': query})
+            )
+            .annotate(search_rank=SearchRank(F('search_document'), search_query) + TrigramSimilarity(f'{prefix}name', query))
+            .order_by('-search_rank', f'{prefix}id')
+        )
+
+    def install(self):
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            for name, index in self.INDEXES.items():
+                cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {MEDICATION_TABLE} {index}')
+
+    def uninstall(self):
+        with connection.cursor() as cursor:
+            for name in self.INDEXES:
+                cursor.execute(f'DROP INDEX IF EXISTS {name}')
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            for name in self.INDEXES:
+                cursor.execute(f'REINDEX INDEX {name}')
+
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    """
+    Return the backend named by the MEDICATION_SEARCH_BACKEND setting, or the
+    best one the database supports.
+    """
+    backend = getattr(settings, 'MEDICATION_SEARCH_BACKEND', None)
+    if backend:
+        return import_string(backend)()
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    if connection.vendor == 'sqlite':
+        try:
+            if SqliteSearchBackend.is_available():
+                return SqliteSearchBackend()
+        except OperationalError:
+            pass
+    return LikeSearchBackend()
+
+
+class MedicationSearchFilter(filters.SearchFilter):
+    """
+    Drop in replacement for SearchFilter that goes through the medication search backend.
+    Views over a model related to Medication set `search_prefix`, e.g. 'medication__'.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        if not get_terms(query):
+            return queryset
+        prefix = getattr(view, 'search_prefix', '')
+        return get_search_backend().search(queryset, query, prefix)
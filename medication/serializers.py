@@ -35,7 +35,7 @@ class SingleMedicationSerializer(serializers.ModelSerializer):
 
 
 class PharmacySerializer(serializers.ModelSerializer):
-    user = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), required=True)
+    user = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), required=True, write_only=True)
 
     def create(self, validated_data):
         user = validated_data.pop('user')
@@ -53,6 +53,7 @@ class PharmacySerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Pharmacy
         fields = '__all__'
+        read_only_fields = models.Pharmacy.COUNTER_FIELDS
         extra_kwargs = {
             'user': {
                 'write_only': True
@@ -65,6 +66,7 @@ class SinglePharmacySerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Pharmacy
         fields = '__all__'
+        read_only_fields = models.Pharmacy.COUNTER_FIELDS
 
 class MinimizedPharmacySerializer(serializers.ModelSerializer):
 
@@ -134,3 +136,10 @@ class StockSerializer(serializers.Serializer):
         instance.price = price
         instance.save()
         return instance
+
+
+class BulkStockRowSerializer(serializers.Serializer):
+    """One row of a bulk stock upload. The medication is checked in bulk, not per row."""
+    medication = serializers.IntegerField(min_value=1)
+    price = serializers.DecimalField(decimal_places=2, max_digits=9)
+    in_stock = serializers.BooleanField()
@@ -1,15 +1,20 @@
-from decimal import Decimal
+import csv
 from django.db.models.aggregates import Count
-from geopy import distance
 
-from rest_framework import filters
 from rest_framework import generics
 from rest_framework import permissions
+from rest_framework.parsers import JSONParser, MultiPartParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from django.db.models import Value
-from core.utils.helpers import add_distance_to_pharmacy, raise_validation_error
-from . import models, serializers
+from core.parsers import CSVParser, CSVReader
+from core.pagination import CustomPageNumberPagination, KeysetPagination
+from core.utils.constants import DEFAULT_NEAREST_LIMIT, DEFAULT_SEARCH_RADIUS, MAX_NEAREST_LIMIT, MAX_SEARCH_RADIUS
+from core.utils.distance import batch_distance, nearest
+from core.utils.helpers import get_bounded_number, get_coordinates, raise_validation_error
+from . import inventory, models, serializers
+from .cache import CachedCatalogMixin
+from .search import MedicationSearchFilter
 from core.permissions import IsAdminOrReadOnly, IsPharmacist
 
 RATING = 'rating'
@@ -18,16 +23,16 @@ DELIVERY_FEE = 'delivery_fee'
 PROXIMITY = 'proximity'
     
 
-class CreateListMedicationView(generics.ListCreateAPIView):
-    """Creates and List Medications"""
+class CreateListMedicationView(CachedCatalogMixin, generics.ListCreateAPIView):
+    """Creates and List Medications. Supports If-None-Match and If-Modified-Since"""
 
     permission_classes = [IsAdminOrReadOnly]
     queryset = models.Medication.objects.all()
     serializer_class = serializers.MedicationSerializer
 
 
-class CreateListCategoriesView(generics.ListCreateAPIView):
-    """Creates and list Categories"""    
+class CreateListCategoriesView(CachedCatalogMixin, generics.ListCreateAPIView):
+    """Creates and list Categories. Supports If-None-Match and If-Modified-Since"""
 
     permission_classes = [IsAdminOrReadOnly]
     queryset = models.Category.objects.all()
@@ -36,48 +41,74 @@ class CreateListCategoriesView(generics.ListCreateAPIView):
 
 class ListPharmacyView(generics.ListAPIView):
     """
-    Creates and list Pharmacies
+    List Pharmacies a page at a time. Follow the `next` link for the following page.
     query parameters:
         - order-by (rating, popularity, delivery_fee, proximity)
         - lat
         - long
+        - radius (km, proximity and delivery_fee only)
+        - page_size
     """
 
     permission_classes = [IsAuthenticated]
     queryset = models.Pharmacy.objects.all()
     serializer_class = serializers.PharmacySerializer
+    pagination_class = KeysetPagination
+    keyset_orderings = {
+        RATING: ('-rating', '-id'),
+        POPULARITY: ('-completed_orders', '-id'),
+    }
 
-    def get_queryset(self):
-        queryset = super().get_queryset()
+    def get_order_by(self):
         order_by = self.request.query_params.get('order-by', PROXIMITY)
+        if order_by not in (RATING, POPULARITY, DELIVERY_FEE, PROXIMITY):
+            raise_validation_error({'order-by': f'Invalid ordering {order_by}'})
+        return order_by
 
-        if order_by == RATING:
-            queryset = queryset.order_by('-rating')
-        elif order_by == POPULARITY:
-            queryset = queryset.order_by('-completed_orders')
-            
-        return queryset
+    @property
+    def keyset_ordering(self):
+        return self.keyset_orderings[self.get_order_by()]
 
     def list(self, request, *args, **kwargs):
         
-        order_by = self.request.query_params.get('order-by', PROXIMITY)
+        order_by = self.get_order_by()
         
         queryset = self.filter_queryset(self.get_queryset())
 
-        serializer = self.get_serializer(queryset, many=True)
-        data = serializer.data.copy()
-        
-        if order_by == PROXIMITY:
-            lat = request.query_params.get('lat')
-            long = request.query_params.get('long')
-            try:
-                lat = Decimal(lat)
-                long = Decimal(long)
-            except ValueError:
-                raise_validation_error({'detail': 'Ensure the latitude and the longitude are specified decimals'})
-            data = [add_distance_to_pharmacy(item, (lat, long)) for item in data]
-            data = sorted(data, key=lambda x: x['distance'], reverse=False)
-        return Response(data)
+        # The delivery fee grows with the distance, so both rank nearest first.
+        if order_by in (PROXIMITY, DELIVERY_FEE):
+            return self.list_by_proximity(queryset)
+
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    def list_by_proximity(self, queryset):
+        """
+        Rank the pharmacies inside the search radius by distance, computed
+        for all of them in one vectorized pass. The same distance is reported.
+        Only the candidate cells are read and only the requested page is serialized.
+        The cursor is the (distance, id) of the last pharmacy on the page.
+        """
+        query_params = self.request.query_params
+        origin = get_coordinates(query_params)
+        radius = get_bounded_number(query_params, 'radius', DEFAULT_SEARCH_RADIUS, MAX_SEARCH_RADIUS, cast=float)
+
+        candidates = list(queryset.near(*origin, radius).values_list('id', 'location_lat', 'location_long'))
+        distances = batch_distance(origin, [candidate[1:] for candidate in candidates])
+        positions = sorted(
+            (float(distance), candidate[0])
+            for candidate, distance in zip(candidates, distances)
+            if distance <= radius
+        )
+        page = self.paginator.paginate_positions(positions, self.request)
+
+        pharmacies = queryset.in_bulk([pk for _, pk in page])
+        serializer = self.get_serializer([pharmacies[pk] for _, pk in page], many=True)
+        data = serializer.data
+        for item, (distance, _) in zip(data, page):
+            item['distance'] = distance
+        return self.get_paginated_response(data)
 
 
 class CreatePharmacyView(generics.CreateAPIView):
@@ -119,6 +150,71 @@ class RetrieveUpdateDestroyMedicationView(generics.RetrieveUpdateDestroyAPIView)
         return Response(data=data)
 
 
+class MedicationAvailabilityView(generics.GenericAPIView):
+    """
+    Nearest pharmacies with the medication in stock, with price and distance(km)
+    query parameters:
+        - medication (one or more comma separated medication ids)
+        - lat
+        - long
+        - radius (km)
+        - limit
+    Each pharmacy lists the requested medications it stocks. has_all is true
+    when it stocks all of them.
+    """
+
+    permission_classes = [IsAuthenticated]
+    queryset = models.PharmacyStock.objects.all()
+
+    def get_medication_ids(self):
+        try:
+            medication_ids = {int(pk) for pk in self.request.query_params.get('medication', '').split(',')}
+        except ValueError:
+            raise_validation_error({'medication': 'Provide one or more comma separated medication ids'})
+        if len(medication_ids) > MAX_NEAREST_LIMIT:
+            raise_validation_error({'medication': f'At most {MAX_NEAREST_LIMIT} medications can be looked up at once'})
+        return medication_ids
+
+    def get(self, request, *args, **kwargs):
+        medication_ids = self.get_medication_ids()
+        origin = get_coordinates(request.query_params)
+        radius = get_bounded_number(request.query_params, 'radius', DEFAULT_SEARCH_RADIUS, MAX_SEARCH_RADIUS, cast=float)
+        limit = get_bounded_number(request.query_params, 'limit', DEFAULT_NEAREST_LIMIT, MAX_NEAREST_LIMIT)
+
+        stock = self.get_queryset().filter(
+            medication_id__in=medication_ids,
+            in_stock=True,
+            pharmacy__in=models.Pharmacy.objects.near(*origin, radius),
+        ).values_list(
+            'pharmacy_id', 'pharmacy__name', 'pharmacy__location_name',
+            'pharmacy__location_lat', 'pharmacy__location_long', 'medication_id', 'price',
+        )
+
+        pharmacies = {}
+        for pharmacy_id, name, location_name, lat, long, medication_id, price in stock:
+            pharmacy = pharmacies.setdefault(pharmacy_id, {
+                'pharmacy': {
+                    'id': pharmacy_id,
+                    'name': name,
+                    'location_name': location_name,
+                    'location_lat': lat,
+                    'location_long': long,
+                },
+                'stock': [],
+            })
+            pharmacy['stock'].append({'medication': medication_id, 'price': price})
+
+        pharmacies = list(pharmacies.values())
+        coordinates = [(item['pharmacy']['location_lat'], item['pharmacy']['location_long']) for item in pharmacies]
+        data = []
+        for index, distance in nearest(origin, coordinates, k=limit, radius=radius):
+            item = pharmacies[index]
+            item['distance'] = distance
+            item['has_all'] = len(item['stock']) == len(medication_ids)
+            data.append(item)
+        return Response(data)
+
+
 class RetrieveUpdateDestroyCategoryView(generics.RetrieveUpdateDestroyAPIView):
     """
     Retrieve, update, and delete Category
@@ -148,43 +244,30 @@ class RatePharmacyView(generics.CreateAPIView):
 class SearchMedication(generics.ListCreateAPIView):
     "Search medication by adding ?search=name parameter to the URL"
 
-    search_fields = ['name', 'scientific_name']
-    filter_backends = (filters.SearchFilter,)
+    filter_backends = (MedicationSearchFilter,)
     queryset = models.Medication.objects.all()
     serializer_class = serializers.MedicationSerializer
     permission_classes = [IsAuthenticated]
 
 class SearchPharmacyMedication(generics.ListCreateAPIView):
-    "Search medicationin a pharmacy by adding ?pharmacy_id=<id>&search=name parameter to the URL"
+    "Search medicationin a pharmacy by adding ?pharmacy_id=<id>&search=name parameter to the URL. Paginated with ?p=<page>"
 
-    queryset = models.Medication.objects.all()
+    queryset = models.PharmacyStock.objects.select_related('medication')
     serializer_class = serializers.SearchStockSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = CustomPageNumberPagination
 
-    search_fields = ['name', 'scientific_name']
-    filter_backends = (filters.SearchFilter,)
+    filter_backends = (MedicationSearchFilter,)
+    search_prefix = 'medication__'
 
     def get_queryset(self):
         pharmacy_id = self.request.query_params.get('pharmacy_id')
-        self.pharmacy_id = pharmacy_id
-        pharmacy = generics.get_object_or_404(models.Pharmacy, pk=pharmacy_id)
-        available_stock = pharmacy.available_stock.filter(in_stock=True)
-        self.available_stock = available_stock
-        medications_ids = [stock.medication.id for stock in available_stock]
-        return models.Medication.objects.filter(id__in=medications_ids)
-
-    def list(self, request, *args, **kwargs):
-        queryset = self.filter_queryset(self.get_queryset())
-        medication_ids = [medication.id for medication in queryset]
-        queryset = models.PharmacyStock.objects.filter(medication__in=medication_ids, pharmacy=self.pharmacy_id)
-
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        generics.get_object_or_404(models.Pharmacy.objects.only('id'), pk=pharmacy_id)
+        return (
+            super().get_queryset()
+            .filter(pharmacy_id=pharmacy_id, in_stock=True)
+            .order_by('medication__name', 'id')
+        )
 
 
 class MedicationStock(generics.GenericAPIView):
@@ -200,6 +283,33 @@ class MedicationStock(generics.GenericAPIView):
         return Response(data=data)
 
 
+class BulkMedicationStock(generics.GenericAPIView):
+    """
+    Create or update many stock entries at once.
+    Send a JSON list of {medication, price, in_stock}, a text/csv body, or a
+    multipart upload named `file`, the CSV ones with a medication,price,in_stock header.
+    Returns the number of entries created and updated and the errors per row.
+    """
+    permission_classes = [IsPharmacist]
+    serializer_class = serializers.BulkStockRowSerializer
+    parser_classes = [JSONParser, CSVParser, MultiPartParser]
+
+    def post(self, request, *args, **kwargs):
+        pharmacy = request.user.pharmacist_profile.pharmacy
+        if not pharmacy:
+            raise_validation_error({"detail": "Create pharmacy first"})
+
+        upload = request.FILES.get('file')
+        if upload is not None:
+            rows = CSVReader(upload)
+        elif isinstance(request.data, (list, csv.DictReader)):
+            rows = request.data
+        else:
+            raise_validation_error({'detail': 'Send a list of stock entries or a CSV file'})
+
+        return Response(data=inventory.upsert_stock(pharmacy, rows))
+
+
 class UpdateharmacyView(generics.RetrieveUpdateAPIView):
     """Update Pharmacy with No Id. This enpoint picks the pharmacy from the request""" 
 
@@ -48,6 +48,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'drf_yasg',
     'corsheaders',
     'authentication',
@@ -218,6 +219,26 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Dispatch and tracking settings
+RIDER_INDEX_BACKEND = 'order.dispatch.RedisRiderIndex'
+# RedisLocationBuffer is shared by every process, LocalLocationBuffer only suits a single one
+LOCATION_BUFFER_BACKEND = 'order.locations.RedisLocationBuffer'
+# Seconds between writes of the buffered rider locations to the database
+LOCATION_FLUSH_INTERVAL = 5
+# Seconds within which rider location updates are coalesced into the newest one
+TRACKING_COALESCE_WINDOW = 1
+# Km a rider must move before an update is forwarded
+TRACKING_MIN_DISTANCE = 0.005
+# Messages per second and burst allowed per tracking socket
+TRACKING_RATE_LIMIT = 5
+TRACKING_BURST = 10
+CELERYBEAT_SCHEDULE = {
+    'flush-order-locations': {
+        'task': 'order.tasks.flush_order_locations',
+        'schedule': LOCATION_FLUSH_INTERVAL,
+    },
+}
+
 EMAIL_BACKEND = "djcelery_email.backends.CeleryEmailBackend"
 EMAIL_HOST = os.getenv("EMAIL_HOST")
 EMAIL_USE_TLS = True
@@ -229,4 +250,6 @@ COMPANY_EMAIL = os.getenv("COMPANY_EMAIL")
 
 CORS_ORIGIN_ALLOW_ALL = True
 
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+
 django_heroku.settings(locals())
@@ -0,0 +1,107 @@
+import json
+
+import msgpack
+
+MSGPACK_SUBPROTOCOL = 'medzako.msgpack.v1'
+# Coordinates travel as integer micro-degrees, about 0.1 m of precision.
+COORDINATE_SCALE = 1000000
+
+# Field names of the tracking messages and their MessagePack keys.
+KEYS = {
+    'success': 's',
+    'message': 'm',
+    'messages': 'n',
+    'tracking_id': 't',
+    'order_location': 'l',
+}
+FIELDS = {key: field for field, key in KEYS.items()}
+
+
+class JSONCodec:
+    """The default wire format, text frames of JSON."""
+    subprotocol = None
+
+    def encode(self, message):
+        """Return the (text_data, bytes_data) to send."""
+        return json.dumps(message), None
+
+    def decode(self, text_data=None, bytes_data=None):
+        """Return the message as a dict, or None when it is not a valid one."""
+        try:
+            message = json.loads(text_data if text_data is not None else bytes_data)
+        except (TypeError, ValueError):
+            return None
+        return message if isinstance(message, dict) else None
+
+
+class MessagePackCodec:
+    """
+    Binary frames of MessagePack negotiated with the medzako.msgpack.v1
+    subprotocol. Messages are maps of the JSON messages with the field names
+    shortened to one letter, see KEYS. An order_location {lat, long} is sent
+    as [lat, long] in micro-degrees minus the previous location sent in the
+    same direction on the connection, the first one being absolute. Each
+    sender and receiver keep that previous location per connection, so a
+    moving rider sends a few bytes per update instead of two doubles.
+    """
+    subprotocol = MSGPACK_SUBPROTOCOL
+
+    def __init__(self):
+        self.sent_location = (0, 0)
+        self.received_location = (0, 0)
+
+    def encode(self, message):
+        packed = {}
+        for field, value in message.items():
+            if field == 'order_location':
+                value = self.encode_location(value)
+            packed[KEYS.get(field, field)] = value
+        return None, msgpack.packb(packed, use_bin_type=True)
+
+    def decode(self, text_data=None, bytes_data=None):
+        if bytes_data is None:
+            return None
+        try:
+            packed = msgpack.unpackb(bytes_data, raw=False)
+        except (ValueError, TypeError, msgpack.UnpackException):
+            return None
+        if not isinstance(packed, dict):
+            return None
+
+        message = {}
+        for key, value in packed.items():
+            field = FIELDS.get(key, key)
+            if field == 'order_location':
+                value = self.decode_location(value)
+            message[field] = value
+        return message
+
+    def encode_location(self, location):
+        lat, long = location.get('lat'), location.get('long')
+        if lat is None or long is None:
+            return None
+        lat, long = round(lat * COORDINATE_SCALE), round(long * COORDINATE_SCALE)
+        previous_lat, previous_long = self.sent_location
+        self.sent_location = (lat, long)
+        return [lat - previous_lat, long - previous_long]
+
+    def decode_location(self, delta):
+        """Return {lat, long}, or the value untouched for the validation to reject."""
+        if not isinstance(delta, (list, tuple)) or len(delta) != 2 or not all(type(value) == int for value in delta):
+            return delta
+        lat = self.received_location[0] + delta[0]
+        long = self.received_location[1] + delta[1]
+        self.received_location = (lat, long)
+        return {'lat': lat / COORDINATE_SCALE, 'long': long / COORDINATE_SCALE}
+
+
+CODECS = (MessagePackCodec,)
+
+
+def get_codec(subprotocols):
+    """A new codec for the first subprotocol the client offered that we speak, JSON otherwise."""
+    for subprotocol in subprotocols:
+        for codec in CODECS:
+            if codec.subprotocol == subprotocol:
+                return codec()
+    return JSONCodec()
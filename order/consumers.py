@@ -1,186 +1,365 @@
 # Built in imports.
+import asyncio
 import json
+from urllib.parse import parse_qs
 from asgiref.sync import sync_to_async
 # Third Party imports.
 from channels.exceptions import DenyConnection
 from channels.generic.websocket import AsyncWebsocketConsumer
 # Django imports.
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from channels.db import database_sync_to_async
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed
 
 # Local imports.
+from core.utils.constants import FINISHED_STATUSES, PHARMACIST
+from .codecs import get_codec
+from .locations import get_location_buffer, get_order_location
 from .models import Order
+from .notifications import get_pharmacy_group, get_tracking_control_group, get_tracking_group
+from . import throttling
+
+# Close code of a socket whose user may not track the order.
+FORBIDDEN_CLOSE_CODE = 4403
+
+
+class TrackingState:
+    """What a tracking connection needs to know about its order, loaded once per connection."""
+    __slots__ = ('order_id', 'tracking_id', 'status', 'customer_id', 'rider_id', 'pharmacy_id')
+
+    def __init__(self, order_id, tracking_id, status, customer_id, rider_id, pharmacy_id):
+        self.order_id = order_id
+        self.tracking_id = tracking_id
+        self.status = status
+        self.customer_id = customer_id
+        self.rider_id = rider_id
+        self.pharmacy_id = pharmacy_id
+
+    @property
+    def is_finished(self):
+        return self.status in FINISHED_STATUSES
 
 @database_sync_to_async
-def fetch_order(order_id):
-    return Order.objects.get(pk=order_id)
+def fetch_tracking_state(order_id):
+    """The TrackingState of an order, or None if it does not exist or is not tracked."""
+    state = Order.objects.filter(pk=order_id, tracking_object__isnull=False).values_list(
+        'id', 'tracking_object__tracking_id', 'status', 'customer_id', 'rider_id', 'pharmacy_id',
+    ).first()
+    return TrackingState(*state) if state else None
 
 @database_sync_to_async
-def update_tracking_loc(consumer_obj, lat, long):
-    consumer_obj.order.tracking_object.lat = lat
-    consumer_obj.order.tracking_object.long = long
-    consumer_obj.order.tracking_object.save()
+def fetch_token_user(scope):
+    """The user of the JWT access token passed as ?token=, or None."""
+    token = parse_qs(scope.get('query_string', b'').decode()).get('token')
+    if not token:
+        return None
+    authentication = JWTAuthentication()
+    try:
+        return authentication.get_user(authentication.get_validated_token(token[0]))
+    except (InvalidToken, AuthenticationFailed):
+        return None
 
 @database_sync_to_async
-def fetch_current_loc(consumer_obj):
-    lat = consumer_obj.order.tracking_object.lat
-    long = consumer_obj.order.tracking_object.long 
-    return float(lat), float(long)
+def fetch_pharmacy_id(user):
+    if user is None or user.user_type != PHARMACIST:
+        return None
+    try:
+        return user.pharmacist_profile.pharmacy_id
+    except ObjectDoesNotExist:
+        return None
+
+async def update_tracking_loc(consumer_obj, lat, long):
+    # Buffered, the database is written in batches by order.locations.flush_locations
+    buffer = get_location_buffer()
+    await sync_to_async(buffer.set, thread_sensitive=False)(consumer_obj.state.order_id, lat, long)
 
 @database_sync_to_async
-def get_tracking_id(consumer_obj):
-    return consumer_obj.order.tracking_object.tracking_id
+def fetch_current_loc(consumer_obj):
+    return get_order_location(consumer_obj.state.order_id) or (None, None)
+
+
+def parse_order_location(data):
+    """Return (lat, long, messages) of a rider location message, lat and long being None when invalid."""
+    order_location = data.get('order_location') if isinstance(data, dict) else None
+    if type(order_location) != dict:
+        return None, None, ['Order location value must be a dictionary']
+
+    lat = order_location.get('lat')
+    long = order_location.get('long')
+    if not lat or not long:
+        return None, None, ['Latitude or longitude not present in payload']
+    try:
+        return float(lat), float(long), []
+    except (TypeError, ValueError):
+        return None, None, ['Latitude and longitude must be numbers']
 
 
-class RiderOrderTrackingConsumer(AsyncWebsocketConsumer):
+class TrackingConsumer(AsyncWebsocketConsumer):
+    """
+    Base of the tracking consumers. The order's TrackingState is loaded once
+    on connect so messages are handled without touching the database. It is
+    reloaded when a control message says the order was reassigned or
+    finished, and the socket is closed once the order is finished.
+    Connect with ?token=<access token>; a user who is not one of the order's
+    participants, see is_authorized, is closed with FORBIDDEN_CLOSE_CODE,
+    also when the order is reassigned away from them.
+    Incoming messages are limited per connection by a token bucket of
+    TRACKING_RATE_LIMIT messages per second and TRACKING_BURST at once.
+    Messages are JSON unless the client offers the medzako.msgpack.v1
+    subprotocol, see codecs.MessagePackCodec. Subclasses handle decoded
+    messages in receive_message and send through send_message.
+    """
 
     async def connect(self):
+        self.bucket = throttling.TokenBucket(
+            getattr(settings, 'TRACKING_RATE_LIMIT', throttling.DEFAULT_RATE_LIMIT),
+            getattr(settings, 'TRACKING_BURST', throttling.DEFAULT_BURST),
+        )
         self.order_id = self.scope['url_route']['kwargs']['order_id']
-        self.order_name = f'Order_{self.order_id}'
+        self.order_name = get_tracking_group(self.order_id)
+        self.control_name = get_tracking_control_group(self.order_id)
+
+        # If invalid order id then deny the connection.
+        self.state = await fetch_tracking_state(self.order_id)
+        if self.state is None:
+            raise DenyConnection("Invalid Order Id")
+        if self.state.is_finished:
+            raise DenyConnection("Order is no longer tracked")
+
+        user = await fetch_token_user(self.scope)
+        self.user_id = user.id if user else None
+        self.user_pharmacy_id = await fetch_pharmacy_id(user)
+
+        self.codec = get_codec(self.scope.get('subprotocols', []))
+        await self.accept(subprotocol=self.codec.subprotocol)
+        if not self.is_authorized():
+            await self.close(code=FORBIDDEN_CLOSE_CODE)
+            return False
 
         await self.channel_layer.group_add(
-            self.order_name,
+            self.control_name,
             self.channel_name
         )
-        # If invalid order id then deny the connection.
-        try:
-            self.order = await fetch_order(self.order_id)
-        except ObjectDoesNotExist:
-            raise DenyConnection("Invalid Order Id")
-        await self.accept()
+        return True
 
-    async def receive(self, text_data):
+    def is_authorized(self):
+        """Whether the connected user may use this socket for the order, checked without the database."""
+        raise NotImplementedError
 
-        try:
-            data = json.loads(text_data)
-            order_location = data.get('order_location')
-            tracking_id = data.get('tracking_id')
-            await self.channel_layer.group_send(
-                self.order_name,
-                {
-                    'type': 'order_location',
-                    'tracking_id': tracking_id,
-                    'order_id': self.order_id,
-                    'order_location': order_location
-                }
-            )
-        except Exception:
-            pass
-        
+    async def websocket_receive(self, message):
+        # Decoded before the rate limit so the codec sees every frame the client sent.
+        data = self.codec.decode(message.get('text'), message.get('bytes'))
+        if not self.is_authorized():
+            return
+        if not self.bucket.consume():
+            await self.rate_limited()
+            return
+        await self.receive_message(data)
 
-    async def order_location(self, event):
-        lat = long = None
-        messages = []
-        is_successful = True
+    async def receive_message(self, data):
+        raise NotImplementedError
 
-        order_location = event['order_location']
-        tracking_id = event['tracking_id']
+    async def rate_limited(self):
+        raise NotImplementedError
+
+    async def send_message(self, message):
+        text_data, bytes_data = self.codec.encode(message)
+        await self.send(text_data=text_data, bytes_data=bytes_data)
+
+    async def tracking_invalidate(self, event):
+        self.state = await fetch_tracking_state(self.order_id)
+        if self.state is None or self.state.is_finished:
+            await self.close()
+        elif not self.is_authorized():
+            await self.close(code=FORBIDDEN_CLOSE_CODE)
+
+    async def websocket_disconnect(self, message):
+        await self.channel_layer.group_discard(
+            self.control_name,
+            self.channel_name
+        )
+        await super().websocket_disconnect(message)
 
-        if type(order_location) == dict:
-            lat = order_location.get('lat')
-            long = order_location.get('long')
-        else:
-            messages.append('Order location value must be a dictionary')
-            is_successful = False
-
-        if not lat or not long:
-            messages.append('Latitude or longitude not present in payload')
-            is_successful = False
-            
-        db_tracking_id = await get_tracking_id(self)
-
-        if tracking_id == db_tracking_id:
-            await update_tracking_loc(self, lat=lat, long=long)
-            messages.append('Update succesful')
-            is_successful = True
-        else:
-            messages.append('Invalid tracking id')
-            is_successful = False
 
-        data = {
+class RiderOrderTrackingConsumer(TrackingConsumer):
+    """
+    Receives the rider's location. Each update is validated here once and
+    then pushed to every customer tracking the order, see ClientOrderTrackingConsumer.
+    Updates are coalesced to at most one per TRACKING_COALESCE_WINDOW seconds,
+    the newest winning, and dropped when the rider moved less than
+    TRACKING_MIN_DISTANCE km, see throttling.LocationCoalescer.
+    """
+
+    async def connect(self):
+        self.coalescer = throttling.LocationCoalescer(
+            getattr(settings, 'TRACKING_COALESCE_WINDOW', throttling.DEFAULT_COALESCE_WINDOW),
+            getattr(settings, 'TRACKING_MIN_DISTANCE', throttling.DEFAULT_MIN_DISTANCE),
+        )
+        self.forward_task = None
+        return await super().connect()
+
+    def is_authorized(self):
+        return self.user_id is not None and self.user_id == self.state.rider_id
+
+    async def receive_message(self, data):
+        lat, long, messages = parse_order_location(data)
+        is_successful = lat is not None
+        if is_successful:
+            if data.get('tracking_id') == self.state.tracking_id:
+                await self.offer_location(lat, long)
+                messages.append('Update succesful')
+            else:
+                messages.append('Invalid tracking id')
+                is_successful = False
+
+        await self.send_message({
             'success': is_successful,
             'messages': messages
-        }
+        })
+
+    async def rate_limited(self):
+        await self.send_message({
+            'success': False,
+            'messages': ['Too many updates, slow down']
+        })
+
+    async def offer_location(self, lat, long):
+        delay = self.coalescer.offer(lat, long)
+        if delay == 0:
+            await self.forward_location(lat, long)
+        elif delay is not None and self.forward_task is None:
+            self.forward_task = asyncio.ensure_future(self.forward_pending_location(delay))
 
-        text_data = json.dumps(data)
+    async def forward_pending_location(self, delay):
+        await asyncio.sleep(delay)
+        self.forward_task = None
+        fix = self.coalescer.pop_pending()
+        if fix is not None:
+            await self.forward_location(*fix)
 
-        # Here helper function fetches data from DB.
-        await self.send(text_data)
+    async def forward_location(self, lat, long):
+        await update_tracking_loc(self, lat=lat, long=long)
+        await self.channel_layer.group_send(
+            self.order_name,
+            {
+                'type': 'order_location',
+                'order_id': self.order_id,
+                'lat': lat,
+                'long': long,
+            }
+        )
 
     async def websocket_disconnect(self, message):
-            # Leave room group
-            await self.channel_layer.group_discard(
-                self.order_name,
-                self.channel_name
-            )
-    
+        if self.forward_task is not None:
+            self.forward_task.cancel()
+        await super().websocket_disconnect(message)
 
-class ClientOrderTrackingConsumer(AsyncWebsocketConsumer):
+
+class ClientOrderTrackingConsumer(TrackingConsumer):
+    """
+    Pushes the rider's location to the customer as it changes. Subscribe by
+    connecting with ?tracking_id=<tracking id> or sending {"tracking_id": ...};
+    the last known location is sent straight away. Sending the tracking id
+    again returns the last location without reading the database.
+    """
 
     async def connect(self):
-        self.order_id = self.scope['url_route']['kwargs']['order_id']
-        self.order_name = f'Order_{self.order_id}_fetch'
-        # if self.scope['user'] == AnonymousUser():
-        #     raise DenyConnection("Invalid User")
-        await self.channel_layer.group_add(
-            self.order_name,
-            self.channel_name
-        )
-        # If invalid order id then deny the connection.
-        try:
-            self.order = await fetch_order(self.order_id)
-        except ObjectDoesNotExist:
-            raise DenyConnection("Invalid Order Id")
-        await self.accept()
+        self.subscribed = False
+        self.location = (None, None)
+        if not await super().connect():
+            return False
+
+        tracking_id = parse_qs(self.scope.get('query_string', b'').decode()).get('tracking_id')
+        if tracking_id:
+            await self.subscribe(tracking_id[0])
+        return True
+
+    def is_authorized(self):
+        """The customer, the rider and the pharmacists of the order's pharmacy."""
+        if self.user_id is not None and self.user_id in (self.state.customer_id, self.state.rider_id):
+            return True
+        return self.user_pharmacy_id is not None and self.user_pharmacy_id == self.state.pharmacy_id
+
+    async def receive_message(self, data):
+        tracking_id = data.get('tracking_id') if data else None
+
+        if self.subscribed and tracking_id == self.state.tracking_id:
+            await self.send_location()
+        else:
+            await self.subscribe(tracking_id)
+
+    async def rate_limited(self):
+        await self.send_location(is_successful=False, message='Too many requests, slow down')
 
-    async def receive(self, text_data):
+    async def subscribe(self, tracking_id):
+        if tracking_id != self.state.tracking_id:
+            await self.send_location(is_successful=False, message='Invalid tracking id')
+            return
 
-        try:
-            tracking_id = json.loads(text_data).get('tracking_id')
-            await self.channel_layer.group_send(
+        if not self.subscribed:
+            await self.channel_layer.group_add(
                 self.order_name,
-                {
-                    'type': 'fetch_order_location',
-                    'orer_id': self.order_id,
-                    'tracking_id': tracking_id,
-                }
+                self.channel_name
             )
-        except Exception:
-            pass
-        
-
-    async def fetch_order_location(self, event):
-        tracking_id = event['tracking_id']
-        is_successful = False
-        message = None
-        lat = long = None
-
-        db_tracking_id = await get_tracking_id(self)
-        if tracking_id == db_tracking_id:
-            lat, long = await fetch_current_loc(self)
-            message = 'Fetch succesful'
-            is_successful = True
-        else:
-            message = 'Invalid tracking id'
-            is_successful = False
-            
-        data = {
+            self.subscribed = True
+        self.location = await fetch_current_loc(self)
+        await self.send_location()
+
+    async def order_location(self, event):
+        self.location = (event['lat'], event['long'])
+        await self.send_location()
+
+    async def send_location(self, is_successful=True, message='Fetch succesful'):
+        lat, long = self.location if is_successful else (None, None)
+        await self.send_message({
             'success': is_successful,
             'message': message,
             'order_location': {
                 'lat': lat,
                 'long': long
-            }  
             }
-
-        text_data = json.dumps(data)
-        
-        await self.send(text_data)
+        })
 
     async def websocket_disconnect(self, message):
-            # Leave room group
+        if self.subscribed:
             await self.channel_layer.group_discard(
                 self.order_name,
                 self.channel_name
             )
-            
\ No newline at end of file
+        await super().websocket_disconnect(message)
+
+
+class PharmacyOrdersConsumer(AsyncWebsocketConsumer):
+    """
+    Pushes new and changed orders of a pharmacy to its pharmacists.
+    Connect with ?token=<access token> of a pharmacist of that pharmacy.
+    """
+
+    async def connect(self):
+        self.pharmacy_id = self.scope['url_route']['kwargs']['pharmacy_id']
+        self.pharmacy_name = get_pharmacy_group(self.pharmacy_id)
+
+        user = await fetch_token_user(self.scope)
+        if await fetch_pharmacy_id(user) != self.pharmacy_id:
+            raise DenyConnection("Invalid pharmacy")
+
+        await self.channel_layer.group_add(
+            self.pharmacy_name,
+            self.channel_name
+        )
+        await self.accept()
+
+    async def order_event(self, event):
+        await self.send(json.dumps({
+            'event': event['event'],
+            'order': event['order'],
+        }))
+
+    async def websocket_disconnect(self, message):
+        await self.channel_layer.group_discard(
+            self.pharmacy_name,
+            self.channel_name
+        )
+        await super().websocket_disconnect(message)
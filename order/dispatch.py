@@ -0,0 +1,237 @@
+import logging
+import math
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists
+from django.utils.module_loading import import_string
+
+from authentication.models import CurrentRiderLocation, RiderProfile
+from core.utils.constants import ACCEPTED, DISPATCH_CANDIDATES, DISPATCH_RADIUS, RIDER_BUSY_STATUSES
+from core.utils.distance import nearest
+from core.utils.geohash import KM_PER_DEGREE
+
+from .models import Order
+from .notifications import invalidate_tracking
+
+logger = logging.getLogger(__name__)
+
+RIDER_INDEX_KEY = 'dispatch:riders'
+GRID_CELL_SIZE = 0.05
+
+
+def get_available_rider_locations():
+    """(user id, lat, long) of every online, approved rider with a known location."""
+    return CurrentRiderLocation.objects.filter(
+        rider_profile__is_online=True,
+        rider_profile__is_approved=True,
+        rider_profile__user__isnull=False,
+        lat__isnull=False,
+        long__isnull=False,
+    ).values_list('rider_profile__user_id', 'lat', 'long')
+
+
+class BaseRiderIndex:
+    """
+    Spatial index of the online riders, keyed by user id, answering
+    k-nearest queries without looking at riders far from the point.
+    """
+
+    def add(self, rider_id, lat, long):
+        raise NotImplementedError
+
+    def remove(self, rider_id):
+        raise NotImplementedError
+
+    def nearest(self, lat, long, radius, k):
+        """Return [(rider id, distance in km)] for up to k riders within radius, nearest first."""
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def rebuild(self):
+        self.clear()
+        for rider_id, lat, long in get_available_rider_locations().iterator():
+            self.add(rider_id, lat, long)
+
+
+class GridRiderIndex(BaseRiderIndex):
+    """
+    In process index bucketing riders into fixed size lat/long cells. A query
+    only reads the cells overlapping the search radius, widening it until k
+    riders are found. It only sees updates made in its own process, so it
+    suits a single process deployment or development.
+    """
+
+    def __init__(self, cell_size=GRID_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.positions = {}
+        self.lock = threading.Lock()
+
+    def get_cell(self, lat, long):
+        return math.floor(lat / self.cell_size), math.floor(long / self.cell_size)
+
+    def add(self, rider_id, lat, long):
+        lat, long = float(lat), float(long)
+        with self.lock:
+            self._discard(rider_id)
+            self.positions[rider_id] = (lat, long)
+            self.cells.setdefault(self.get_cell(lat, long), set()).add(rider_id)
+
+    def remove(self, rider_id):
+        with self.lock:
+            self._discard(rider_id)
+
+    def _discard(self, rider_id):
+        position = self.positions.pop(rider_id, None)
+        if position is None:
+            return
+        cell = self.get_cell(*position)
+        self.cells[cell].discard(rider_id)
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    def get_candidates(self, lat, long, radius):
+        delta_lat = radius / KM_PER_DEGREE
+        delta_long = radius / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+        min_row, min_column = self.get_cell(lat - delta_lat, long - delta_long)
+        max_row, max_column = self.get_cell(lat + delta_lat, long + delta_long)
+        with self.lock:
+            return [
+                (rider_id, self.positions[rider_id])
+                for row in range(min_row, max_row + 1)
+                for column in range(min_column, max_column + 1)
+                for rider_id in self.cells.get((row, column), ())
+            ]
+
+    def nearest(self, lat, long, radius, k):
+        lat, long = float(lat), float(long)
+        search_radius = min(self.cell_size * KM_PER_DEGREE, radius)
+        while True:
+            candidates = self.get_candidates(lat, long, search_radius)
+            # Only riders within the searched radius are certain to be the nearest ones
+            closest = nearest((lat, long), [position for _, position in candidates], k=k, radius=search_radius, exact=False)
+            if len(closest) >= k or search_radius >= radius:
+                return [(candidates[index][0], distance) for index, distance in closest]
+            search_radius = min(search_radius * 2, radius)
+
+    def clear(self):
+        with self.lock:
+            self.cells = {}
+            self.positions = {}
+
+
+class RedisRiderIndex(BaseRiderIndex):
+    """Redis GEO set shared by every process, queried with GEORADIUS."""
+
+    def __init__(self, key=RIDER_INDEX_KEY):
+        import redis
+
+        self.key = key
+        self.client = redis.Redis(host=settings.REDIS_HOST)
+
+    def add(self, rider_id, lat, long):
+        self.client.execute_command('GEOADD', self.key, float(long), float(lat), rider_id)
+
+    def remove(self, rider_id):
+        self.client.zrem(self.key, rider_id)
+
+    def nearest(self, lat, long, radius, k):
+        riders = self.client.georadius(self.key, float(long), float(lat), radius, unit='km', withdist=True, count=k, sort='ASC')
+        return [(int(rider_id), distance) for rider_id, distance in riders]
+
+    def clear(self):
+        self.client.delete(self.key)
+
+
+@lru_cache(maxsize=None)
+def get_rider_index():
+    """Return the index named by the RIDER_INDEX_BACKEND setting."""
+    backend = getattr(settings, 'RIDER_INDEX_BACKEND', 'order.dispatch.RedisRiderIndex')
+    index = import_string(backend)()
+    if isinstance(index, GridRiderIndex):
+        index.rebuild()
+    return index
+
+
+def update_rider_index(rider_profile):
+    """Add the rider to the index if they can take orders, remove them otherwise."""
+    try:
+        location = rider_profile.current_location
+    except CurrentRiderLocation.DoesNotExist:
+        location = None
+
+    try:
+        if not rider_profile.user_id:
+            return
+        if rider_profile.is_online and rider_profile.is_approved and location and location.lat is not None and location.long is not None:
+            get_rider_index().add(rider_profile.user_id, location.lat, location.long)
+        else:
+            get_rider_index().remove(rider_profile.user_id)
+    except Exception:
+        # The index is rebuilt by rebuild_rider_index, a failed update must not fail the request
+        logger.exception('Could not update the rider index for rider %s', rider_profile.user_id)
+
+
+def get_busy_orders(rider_id):
+    return Order.objects.filter(rider_id=rider_id, status__in=RIDER_BUSY_STATUSES)
+
+
+def find_riders(lat, long, radius=DISPATCH_RADIUS, k=DISPATCH_CANDIDATES):
+    """
+    [(rider id, distance)] of up to k of the nearest riders who are not
+    delivering an order. The index does not know who is busy, so while every
+    rider it returned is busy the search doubles the number it asks for,
+    until it has free riders or has run out of riders within the radius.
+    """
+    count = k
+    while True:
+        riders = get_rider_index().nearest(lat, long, radius, count)
+        busy = set(
+            Order.objects
+            .filter(rider_id__in=[rider_id for rider_id, _ in riders], status__in=RIDER_BUSY_STATUSES)
+            .values_list('rider_id', flat=True)
+        )
+        available = [(rider_id, distance) for rider_id, distance in riders if rider_id not in busy]
+        if available or len(riders) < count:
+            return available[:k]
+        count *= 2
+
+
+def assign_rider(order):
+    """
+    Assign the nearest available rider to an accepted order and return
+    (rider id, distance), or None when no rider is available. Each attempt
+    locks the rider's profile and then makes one conditional UPDATE, so an
+    order never gets two riders and a rider never gets an order while
+    delivering another.
+    """
+    pharmacy = order.pharmacy
+    for rider_id, distance in find_riders(pharmacy.location_lat, pharmacy.location_long):
+        with transaction.atomic():
+            # Concurrent dispatches to the same rider wait here, so the busy
+            # check below sees an order assigned to them by another one.
+            available = (
+                RiderProfile.objects.select_for_update()
+                .filter(user_id=rider_id, is_online=True, is_approved=True)
+                .values_list('id', flat=True)
+                .first()
+            )
+            assigned = available is not None and (
+                Order.objects
+                .filter(pk=order.pk, rider__isnull=True, status=ACCEPTED)
+                .filter(~Exists(get_busy_orders(rider_id)))
+                .update(rider_id=rider_id)
+            )
+        if assigned:
+            order.rider_id = rider_id
+            invalidate_tracking(order.pk)
+            return rider_id, distance
+        if not Order.objects.filter(pk=order.pk, rider__isnull=True, status=ACCEPTED).exists():
+            # Assigned or moved on meanwhile
+            return None
+    return None
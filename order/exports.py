@@ -0,0 +1,87 @@
+import csv
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from . import models
+
+EXPORT_CHUNK_SIZE = 2000
+CSV = 'csv'
+JSONL = 'jsonl'
+CONTENT_TYPES = {
+    CSV: 'text/csv',
+    JSONL: 'application/x-ndjson',
+}
+
+# Per dataset: the queryset, the exported columns and the pharmacy lookup used to scope it
+EXPORTS = {
+    'orders': (
+        models.Order.objects.all(),
+        (
+            'id', 'created_at', 'customer_id', 'pharmacy_id', 'rider_id', 'status', 'total_price',
+            'delivery_fee', 'is_payment_complete', 'payment_reference',
+        ),
+        'pharmacy_id',
+    ),
+    'order-items': (
+        models.OrderItem.objects.all(),
+        ('id', 'created_at', 'order_id', 'medication_id', 'medication__name', 'quantity', 'price'),
+        'order__pharmacy_id',
+    ),
+    'earnings': (
+        models.OrderEarning.objects.all(),
+        ('id', 'created_at', 'order_id', 'pharmacy_id', 'rider_id', 'pharmacy_earning', 'rider_earning'),
+        'pharmacy_id',
+    ),
+}
+
+
+class Echo:
+    """File-like object whose write returns the value, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def get_export_rows(dataset, pharmacy_id=None, start=None, end=None):
+    """The (columns, row tuples) of a dataset, read in chunks from a server side cursor."""
+    queryset, columns, pharmacy_lookup = EXPORTS[dataset]
+    if pharmacy_id is not None:
+        queryset = queryset.filter(**{pharmacy_lookup: pharmacy_id})
+    if start:
+        queryset = queryset.filter(created_at__date__gte=start)
+    if end:
+        queryset = queryset.filter(created_at__date__lte=end)
+    rows = queryset.order_by('id').values_list(*columns).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    return columns, rows
+
+
+def to_csv(columns, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def to_jsonl(columns, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+def gzipped(lines):
+    """Compress a stream of text to gzip, a buffer at a time."""
+    compressor = zlib.compressobj(wbits=31)
+    for line in lines:
+        chunk = compressor.compress(line.encode())
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+def stream_export(dataset, output, compress=False, **filters):
+    columns, rows = get_export_rows(dataset, **filters)
+    lines = to_csv(columns, rows) if output == CSV else to_jsonl(columns, rows)
+    if compress:
+        return gzipped(lines)
+    return (line.encode() for line in lines)
@@ -0,0 +1,90 @@
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+
+from core.exceptions import Conflict
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+DEFAULT_IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+
+
+class IdempotencyConflict(Conflict):
+    default_detail = 'A request with this Idempotency-Key is still being processed'
+    default_code = 'idempotency_conflict'
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'This Idempotency-Key was already used with a different request'
+    default_code = 'idempotency_key_reused'
+
+
+def get_scope(request):
+    if request.user and request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return 'anonymous'
+
+
+def get_request_hash(request):
+    payload = json.dumps([request.method, request.path, request.data], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class IdempotentCreateMixin:
+    """
+    Makes `create` safe to retry. A POST carrying an Idempotency-Key header
+    is performed once per client and key. Retries within the TTL get the
+    stored response back with an Idempotent-Replayed header. A retry that
+    arrives while the first request is still running gets a 409.
+    Requests without the header behave as before.
+    """
+
+    def create(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return super().create(request, *args, **kwargs)
+        if len(key) > IdempotencyKey._meta.get_field('key').max_length:
+            raise ValidationError({IDEMPOTENCY_HEADER: 'Key is too long'})
+
+        scope = get_scope(request)
+        request_hash = get_request_hash(request)
+        now = timezone.now()
+        ttl = getattr(settings, 'IDEMPOTENCY_KEY_TTL', DEFAULT_IDEMPOTENCY_KEY_TTL)
+
+        IdempotencyKey.objects.filter(scope=scope, key=key, expires_at__lte=now).delete()
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(scope=scope, key=key, request_hash=request_hash, expires_at=now + ttl)
+        except IntegrityError:
+            return self.replay(scope, key, request_hash)
+
+        try:
+            response = super().create(request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+
+        if response.status_code >= 500:
+            record.delete()
+        else:
+            record.response_status = response.status_code
+            record.response_body = response.data
+            record.save(update_fields=['response_status', 'response_body', 'updated_at'])
+        return response
+
+    def replay(self, scope, key, request_hash):
+        record = IdempotencyKey.objects.filter(scope=scope, key=key).first()
+        if record is None or record.response_status is None:
+            raise IdempotencyConflict()
+        if record.request_hash != request_hash:
+            raise IdempotencyKeyReused()
+        return Response(record.response_body, status=record.response_status, headers={REPLAYED_HEADER: 'true'})
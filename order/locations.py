@@ -0,0 +1,213 @@
+import threading
+from decimal import Decimal
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import CurrentOrderLocation
+
+LOCATIONS_KEY = 'tracking:locations'
+DIRTY_KEY = 'tracking:dirty'
+DEFAULT_FLUSH_INTERVAL = 5
+FLUSH_BATCH_SIZE = 500
+
+
+def get_flush_interval():
+    return getattr(settings, 'LOCATION_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+
+
+class BaseLocationBuffer:
+    """
+    Write-behind store of the latest location of each tracked order. Riders
+    write to the buffer and readers read from it; the changed locations are
+    written to CurrentOrderLocation in batches by flush_locations, so the
+    database sees at most one batch per flush interval however many riders
+    there are.
+    """
+
+    def set(self, order_id, lat, long):
+        raise NotImplementedError
+
+    def get(self, order_id):
+        """Return (lat, long) or None if the order has no buffered location."""
+        raise NotImplementedError
+
+    def pop_dirty(self, count):
+        """Return {order_id: (lat, long)} for up to count orders changed since they were last popped."""
+        raise NotImplementedError
+
+    def pop(self, order_id):
+        """
+        Remove the order from the buffer. Return its (lat, long) if it changed
+        since it was last popped, else None.
+        """
+        raise NotImplementedError
+
+    def schedule_release(self, order_id, delay):
+        """Run release_location for the order in delay seconds, by default on a Celery worker."""
+        from .tasks import release_order_location
+
+        release_order_location.apply_async((order_id,), countdown=delay)
+
+
+class LocalLocationBuffer(BaseLocationBuffer):
+    """
+    In process buffer. Celery workers cannot see it, so a timer thread of
+    the writing process flushes it a flush interval after the first change,
+    and releases finished orders in process too. Suits a single process or
+    development.
+    """
+
+    def __init__(self):
+        self.locations = {}
+        self.dirty = set()
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def set(self, order_id, lat, long):
+        with self.lock:
+            self.locations[order_id] = (float(lat), float(long))
+            self.dirty.add(order_id)
+            if self.timer is None:
+                self.timer = threading.Timer(get_flush_interval(), self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def get(self, order_id):
+        return self.locations.get(order_id)
+
+    def pop_dirty(self, count):
+        with self.lock:
+            order_ids = [self.dirty.pop() for _ in range(min(count, len(self.dirty)))]
+            return {order_id: self.locations[order_id] for order_id in order_ids}
+
+    def pop(self, order_id):
+        with self.lock:
+            location = self.locations.pop(order_id, None)
+            if order_id not in self.dirty:
+                return None
+            self.dirty.discard(order_id)
+            return location
+
+    def flush(self):
+        with self.lock:
+            self.timer = None
+        try:
+            flush_locations()
+        finally:
+            connections.close_all()
+
+    def schedule_release(self, order_id, delay):
+        timer = threading.Timer(delay, self.release, (order_id,))
+        timer.daemon = True
+        timer.start()
+
+    def release(self, order_id):
+        try:
+            release_location(order_id)
+        finally:
+            connections.close_all()
+
+
+class RedisLocationBuffer(BaseLocationBuffer):
+    """
+    Redis hash of order id to "lat,long" plus a set of the changed order ids,
+    shared by every process and flushed by the flush_order_locations beat task.
+    """
+
+    def __init__(self):
+        import redis
+
+        self.client = redis.Redis(host=settings.REDIS_HOST)
+
+    def set(self, order_id, lat, long):
+        pipeline = self.client.pipeline()
+        pipeline.hset(LOCATIONS_KEY, order_id, f'{float(lat)},{float(long)}')
+        pipeline.sadd(DIRTY_KEY, order_id)
+        pipeline.execute()
+
+    def get(self, order_id):
+        location = self.client.hget(LOCATIONS_KEY, order_id)
+        return self.parse(location)
+
+    def pop(self, order_id):
+        pipeline = self.client.pipeline()
+        pipeline.hget(LOCATIONS_KEY, order_id)
+        pipeline.srem(DIRTY_KEY, order_id)
+        pipeline.hdel(LOCATIONS_KEY, order_id)
+        location, was_dirty, _ = pipeline.execute()
+        return self.parse(location) if was_dirty else None
+
+    def pop_dirty(self, count):
+        order_ids = self.client.spop(DIRTY_KEY, count)
+        if not order_ids:
+            return {}
+        locations = self.client.hmget(LOCATIONS_KEY, order_ids)
+        return {
+            int(order_id): self.parse(location)
+            for order_id, location in zip(order_ids, locations)
+            if location is not None
+        }
+
+    @staticmethod
+    def parse(location):
+        if location is None:
+            return None
+        lat, long = location.decode().split(',')
+        return float(lat), float(long)
+
+
+@lru_cache(maxsize=None)
+def get_location_buffer():
+    """Return the buffer named by the LOCATION_BUFFER_BACKEND setting."""
+    backend = getattr(settings, 'LOCATION_BUFFER_BACKEND', 'order.locations.RedisLocationBuffer')
+    return import_string(backend)()
+
+
+def get_order_location(order_id):
+    """The latest (lat, long) of an order, from the buffer or else the database."""
+    location = get_location_buffer().get(order_id)
+    if location is not None:
+        return location
+    tracking = CurrentOrderLocation.objects.filter(order_id=order_id).values_list('lat', 'long').first()
+    if tracking is None:
+        return None
+    return float(tracking[0]), float(tracking[1])
+
+
+def schedule_release(order_id):
+    """Release a finished order once its rider's socket has closed and its last update is in."""
+    get_location_buffer().schedule_release(order_id, get_flush_interval())
+
+
+def release_location(order_id):
+    """Drop a finished order from the buffer, writing its last location to the database first."""
+    location = get_location_buffer().pop(order_id)
+    if location is None:
+        return
+    lat, long = location
+    CurrentOrderLocation.objects.filter(order_id=order_id).update(
+        lat=Decimal(str(lat)), long=Decimal(str(long)), updated_at=timezone.now(),
+    )
+
+
+def flush_locations(batch_size=FLUSH_BATCH_SIZE):
+    """Write the buffered locations to CurrentOrderLocation, a batch at a time. Returns the number written."""
+    buffer = get_location_buffer()
+    flushed = 0
+    while True:
+        locations = buffer.pop_dirty(batch_size)
+        if not locations:
+            return flushed
+        now = timezone.now()
+        tracking_objects = list(CurrentOrderLocation.objects.filter(order_id__in=locations).only('id', 'order_id'))
+        for tracking in tracking_objects:
+            lat, long = locations[tracking.order_id]
+            tracking.lat = Decimal(str(lat))
+            tracking.long = Decimal(str(long))
+            tracking.updated_at = now
+        CurrentOrderLocation.objects.bulk_update(tracking_objects, ['lat', 'long', 'updated_at'])
+        flushed += len(tracking_objects)
@@ -0,0 +1,67 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.utils.helpers import generate_random_string
+from order.codecs import JSONCodec, MessagePackCodec
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the tracking wire formats on a simulated delivery: bytes per '
+        'rider update, rider acknowledgement and customer push, and the time '
+        'to encode each'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--updates', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        path = self.simulate_path(options['updates'], random.Random(options['seed']))
+        tracking_id = generate_random_string(12)
+        messages = {
+            'rider update': [
+                {'tracking_id': tracking_id, 'order_location': {'lat': lat, 'long': long}}
+                for lat, long in path
+            ],
+            'rider ack': [{'success': True, 'messages': ['Update succesful']}] * len(path),
+            'customer push': [
+                {'success': True, 'message': 'Fetch succesful', 'order_location': {'lat': lat, 'long': long}}
+                for lat, long in path
+            ],
+        }
+
+        self.stdout.write(f'{"message":<16}{"codec":<18}{"bytes/msg":>10}{"encode us":>11}{"decode us":>11}')
+        for name, batch in messages.items():
+            for codec_class in (JSONCodec, MessagePackCodec):
+                size, encode_time, decode_time = self.measure(codec_class, batch)
+                self.stdout.write(
+                    f'{name:<16}{codec_class.__name__:<18}{size / len(batch):>10.1f}'
+                    f'{encode_time / len(batch) * 1e6:>11.2f}{decode_time / len(batch) * 1e6:>11.2f}'
+                )
+
+    def simulate_path(self, updates, rng):
+        """A rider moving about 10 m per update from central Nairobi."""
+        lat, long = -1.286389, 36.817223
+        path = []
+        for _ in range(updates):
+            lat += rng.uniform(-1e-4, 1e-4)
+            long += rng.uniform(-1e-4, 1e-4)
+            path.append((round(lat, 6), round(long, 6)))
+        return path
+
+    def measure(self, codec_class, batch):
+        encoder, decoder = codec_class(), codec_class()
+        started = time.perf_counter()
+        frames = [encoder.encode(message) for message in batch]
+        encode_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for text_data, bytes_data in frames:
+            decoder.decode(text_data, bytes_data)
+        decode_time = time.perf_counter() - started
+
+        size = sum(len(text_data.encode() if text_data is not None else bytes_data) for text_data, bytes_data in frames)
+        return size, encode_time, decode_time
@@ -0,0 +1,39 @@
+from django.db import transaction
+from django.db.models import Count, DateField, Sum
+from django.db.models.functions import TruncDate, TruncWeek
+from django.core.management.base import BaseCommand
+
+from core.utils.constants import DAILY, WEEKLY
+from order.models import EarningRollup, OrderEarning
+
+TRUNCATE = {
+    DAILY: TruncDate,
+    WEEKLY: TruncWeek,
+}
+OWNERS = {
+    'pharmacy_id': 'pharmacy_earning',
+    'rider_id': 'rider_earning',
+}
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily and weekly earning rollups from the order earnings'
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        EarningRollup.objects.all().delete()
+        rollups = []
+        for period, truncate in TRUNCATE.items():
+            for owner, earning in OWNERS.items():
+                totals = (
+                    OrderEarning.objects
+                    .filter(**{f'{owner}__isnull': False})
+                    .annotate(period_start=truncate('created_at', output_field=DateField()))
+                    .order_by()
+                    .values(owner, 'period_start')
+                    .annotate(earnings=Sum(earning), orders=Count('id'))
+                )
+                rollups.extend(EarningRollup(period=period, **total) for total in totals)
+
+        EarningRollup.objects.bulk_create(rollups, batch_size=1000)
+        self.stdout.write(self.style.SUCCESS(f'Created {len(rollups)} earning rollups'))
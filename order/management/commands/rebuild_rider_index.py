@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from order.dispatch import get_rider_index
+
+
+class Command(BaseCommand):
+    help = 'Reload the online riders into the dispatch index'
+
+    def handle(self, *args, **options):
+        get_rider_index().rebuild()
+        self.stdout.write(self.style.SUCCESS('Rebuilt the rider index'))
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.7 on 2026-10-18 15:44
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('order', '0023_order_customer_created_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='OrderStatusHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('from_status', models.CharField(choices=[('received', 'received'), ('accepted', 'accepted'), ('dispatched', 'dispatched'), ('delivered', 'delivered'), ('canceled', 'canceled'), ('rejected', 'rejected')], max_length=30)),
+                ('to_status', models.CharField(choices=[('received', 'received'), ('accepted', 'accepted'), ('dispatched', 'dispatched'), ('delivered', 'delivered'), ('canceled', 'canceled'), ('rejected', 'rejected')], max_length=30)),
+                ('version', models.PositiveIntegerField()),
+                ('changed_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_status_changes', to=settings.AUTH_USER_MODEL)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_history', to='order.order')),
+            ],
+            options={
+                'unique_together': {('order', 'version')},
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.7 on 2026-10-18 15:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0024_order_version_status_history'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['pharmacy', 'status', '-created_at', '-id'], name='order_order_pharmac_aaad27_idx'),
+        ),
+    ]
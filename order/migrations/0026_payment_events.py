@@ -0,0 +1,41 @@
+# Generated by Django 3.2.7 on 2026-10-18 15:46
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0025_order_pharmacy_status_created_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('event_id', models.CharField(max_length=50, unique=True)),
+                ('event', models.CharField(max_length=50)),
+                ('payload', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('processed_at', models.DateTimeField(db_index=True, null=True)),
+                ('error', models.TextField(null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='payment',
+            field=models.OneToOneField(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order', to='order.payment'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='payment_reference',
+            field=models.CharField(editable=False, max_length=20, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 3.2.7 on 2026-10-18 15:47
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medication', '0018_catalogversion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('order', '0026_payment_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EarningRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('period', models.CharField(choices=[('daily', 'daily'), ('weekly', 'weekly')], max_length=10)),
+                ('period_start', models.DateField()),
+                ('earnings', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('orders', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='orderearning',
+            index=models.Index(fields=['pharmacy', '-created_at', '-id'], name='order_order_pharmac_b06bcd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderearning',
+            index=models.Index(fields=['rider', '-created_at', '-id'], name='order_order_rider_i_11844f_idx'),
+        ),
+        migrations.AddField(
+            model_name='earningrollup',
+            name='pharmacy',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='earning_rollups', to='medication.pharmacy'),
+        ),
+        migrations.AddField(
+            model_name='earningrollup',
+            name='rider',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='earning_rollups', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='earningrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('pharmacy__isnull', False)), fields=('pharmacy', 'period', 'period_start'), name='unique_pharmacy_earning_rollup'),
+        ),
+        migrations.AddConstraint(
+            model_name='earningrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('rider__isnull', False)), fields=('rider', 'period', 'period_start'), name='unique_rider_earning_rollup'),
+        ),
+    ]
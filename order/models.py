@@ -1,8 +1,15 @@
-from django.db import models
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
 from cloudinary.models import CloudinaryField
 
 from core.models import AbstractBaseModel
-from core.utils.constants import PAYMENTS, RECEIVED, STATUSES
+from core.utils.constants import DAILY, DELIVERED, PAYMENTS, RECEIVED, ROLLUP_PERIODS, STATUS_TRANSITIONS, STATUSES, WEEKLY
 
 
 class Order(AbstractBaseModel):
@@ -19,7 +26,9 @@ class Order(AbstractBaseModel):
         on_delete=models.SET_NULL,
         related_name='order',
         null=True
-    ),
+    )
+    # Sent to the payment provider as tx_ref so the webhook can find the order
+    payment_reference = models.CharField(max_length=20, unique=True, null=True, editable=False)
     pharmacy = models.ForeignKey(
         'medication.Pharmacy',
         on_delete=models.SET_NULL,
@@ -55,10 +64,71 @@ class Order(AbstractBaseModel):
         related_name='rider_orders',
         null=True
     )
+    version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', '-created_at', '-id']),
+            models.Index(fields=['pharmacy', 'status', '-created_at', '-id']),
+        ]
 
     def __str__(self):
         return f'{self.customer.full_name} Order: {self.pk}'
 
+    def can_transition(self, status):
+        return status == self.status or status in STATUS_TRANSITIONS[self.status]
+
+    def update_status(self, status, action_reason=None, changed_by=None):
+        """
+        Compare-and-swap update: the row only changes if its version is still
+        the one this instance was loaded with, so of two concurrent updates
+        exactly one wins without locking the row. Returns whether this one did.
+        """
+        fields = {
+            'status': status,
+            'is_completed': status == DELIVERED,
+            'version': self.version + 1,
+            'updated_at': timezone.now(),
+        }
+        if action_reason is not None:
+            fields['action_reason'] = action_reason
+
+        with transaction.atomic():
+            if not Order.objects.filter(pk=self.pk, version=self.version).update(**fields):
+                return False
+            if status != self.status:
+                OrderStatusHistory.objects.create(
+                    order=self,
+                    from_status=self.status,
+                    to_status=status,
+                    version=fields['version'],
+                    changed_by=changed_by,
+                )
+
+        for field, value in fields.items():
+            setattr(self, field, value)
+        return True
+
+
+class OrderStatusHistory(AbstractBaseModel):
+    order = models.ForeignKey(
+        'order.Order',
+        on_delete=models.CASCADE,
+        related_name='status_history',
+    )
+    from_status = models.CharField(choices=STATUSES, max_length=30)
+    to_status = models.CharField(choices=STATUSES, max_length=30)
+    version = models.PositiveIntegerField()
+    changed_by = models.ForeignKey(
+        'authentication.User',
+        on_delete=models.SET_NULL,
+        related_name='order_status_changes',
+        null=True
+    )
+
+    class Meta:
+        unique_together = ['order', 'version']
+
 
 class OrderItem(AbstractBaseModel):
     order = models.ForeignKey(
@@ -90,6 +160,18 @@ class Payment(AbstractBaseModel):
 
 
 
+class PaymentEvent(AbstractBaseModel):
+    """
+    Raw payment provider webhook call, stored as received and processed in
+    batches by order.tasks.process_payment_events.
+    """
+    event_id = models.CharField(max_length=50, unique=True)
+    event = models.CharField(max_length=50)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    processed_at = models.DateTimeField(null=True, db_index=True)
+    error = models.TextField(null=True)
+
+
 class Location(models.Model):
     customer = models.ForeignKey(
         'authentication.User',
@@ -139,3 +221,96 @@ class OrderEarning(AbstractBaseModel):
 
     rider_earning = models.DecimalField(max_digits=9, decimal_places=2)
     pharmacy_earning = models.DecimalField(max_digits=9, decimal_places=2)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['pharmacy', '-created_at', '-id']),
+            models.Index(fields=['rider', '-created_at', '-id']),
+        ]
+
+
+def get_period_start(day, period):
+    if period == WEEKLY:
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+class EarningRollup(AbstractBaseModel):
+    """
+    Earnings and number of orders of a pharmacy or a rider per day or week
+    (starting on Monday). Kept up to date as OrderEarnings are created;
+    rebuild with the rebuild_earning_rollups command.
+    """
+    period = models.CharField(choices=ROLLUP_PERIODS, max_length=10)
+    period_start = models.DateField()
+    pharmacy = models.ForeignKey(
+        'medication.Pharmacy',
+        on_delete=models.CASCADE,
+        related_name='earning_rollups',
+        null=True
+    )
+    rider = models.ForeignKey(
+        'authentication.User',
+        on_delete=models.CASCADE,
+        related_name='earning_rollups',
+        null=True
+    )
+    earnings = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['pharmacy', 'period', 'period_start'],
+                condition=Q(pharmacy__isnull=False),
+                name='unique_pharmacy_earning_rollup',
+            ),
+            models.UniqueConstraint(
+                fields=['rider', 'period', 'period_start'],
+                condition=Q(rider__isnull=False),
+                name='unique_rider_earning_rollup',
+            ),
+        ]
+
+    @classmethod
+    def add(cls, period, period_start, earnings, **owner):
+        """Add one order's earnings to the rollup of owner, pharmacy_id or rider_id."""
+        rollups = cls.objects.filter(period=period, period_start=period_start, **owner)
+        changes = {'earnings': F('earnings') + earnings, 'orders': F('orders') + 1, 'updated_at': timezone.now()}
+        if rollups.update(**changes):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(period=period, period_start=period_start, earnings=earnings, orders=1, **owner)
+        except IntegrityError:
+            # Created concurrently
+            rollups.update(**changes)
+
+
+class IdempotencyKey(AbstractBaseModel):
+    """
+    Response of a POST made with an Idempotency-Key header, replayed when the
+    same client retries with the same key. See order.idempotency.
+    """
+    scope = models.CharField(max_length=50)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    response_status = models.PositiveSmallIntegerField(null=True)
+    response_body = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ['scope', 'key']
+
+
+@receiver(post_save, sender=OrderEarning, dispatch_uid="roll_up_order_earning")
+def roll_up_order_earning(sender, instance, created, **kwargs):
+    if not created:
+        return
+    day = timezone.localdate(instance.created_at)
+    for period in (DAILY, WEEKLY):
+        period_start = get_period_start(day, period)
+        if instance.pharmacy_id:
+            EarningRollup.add(period, period_start, instance.pharmacy_earning, pharmacy_id=instance.pharmacy_id)
+        if instance.rider_id:
+            EarningRollup.add(period, period_start, instance.rider_earning, rider_id=instance.rider_id)
@@ -0,0 +1,61 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+from core.utils.helpers import optimize_queryset
+
+ORDER_CREATED = 'order_created'
+ORDER_UPDATED = 'order_updated'
+
+
+def get_pharmacy_group(pharmacy_id):
+    return f'Pharmacy_{pharmacy_id}'
+
+
+def get_tracking_group(order_id):
+    """Group of the customer sockets tracking an order."""
+    return f'Order_{order_id}'
+
+
+def get_tracking_control_group(order_id):
+    """Group of every rider and customer socket of an order, for control messages."""
+    return f'Order_{order_id}_control'
+
+
+def invalidate_tracking(order_id):
+    """
+    Tell the order's tracking sockets to reload their cached state once the
+    current transaction commits. Sent when the order is reassigned or finished.
+    """
+    def send():
+        async_to_sync(get_channel_layer().group_send)(
+            get_tracking_control_group(order_id),
+            {'type': 'tracking_invalidate', 'order_id': order_id}
+        )
+
+    transaction.on_commit(send)
+
+
+def notify_pharmacy(order, event):
+    """
+    Push the order to the pharmacy's inbox connections once the current
+    transaction commits, so a rolled back change is never announced.
+    """
+    if not order.pharmacy_id:
+        return
+
+    def send():
+        from .models import Order
+        from .serializers import PharmacyOrderSerializer
+
+        instance = optimize_queryset(Order.objects.filter(pk=order.pk), PharmacyOrderSerializer).first()
+        async_to_sync(get_channel_layer().group_send)(
+            get_pharmacy_group(order.pharmacy_id),
+            {
+                'type': 'order_event',
+                'event': event,
+                'order': PharmacyOrderSerializer(instance).data,
+            }
+        )
+
+    transaction.on_commit(send)
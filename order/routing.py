@@ -1,6 +1,6 @@
 from django.urls import path
 from channels.routing import ProtocolTypeRouter, URLRouter
-from .consumers import RiderOrderTrackingConsumer, ClientOrderTrackingConsumer
+from .consumers import RiderOrderTrackingConsumer, ClientOrderTrackingConsumer, PharmacyOrdersConsumer
 
 
 websockets = URLRouter([
@@ -12,4 +12,8 @@ websockets = URLRouter([
         "ws/fetch-order-location/<int:order_id>", ClientOrderTrackingConsumer.as_asgi(),
         name="fetch-order-location",    
     ),
+    path(
+        "ws/pharmacy-orders/<int:pharmacy_id>", PharmacyOrdersConsumer.as_asgi(),
+        name="pharmacy-orders",
+    ),
 ])
@@ -1,24 +1,20 @@
 from rest_framework import serializers
-from django.db.utils import IntegrityError
+from rest_framework.exceptions import PermissionDenied
+from django.db import transaction
 from authentication.serializers import UserSerializer
 
-from core.utils.constants import DELIVERED
+from core.exceptions import Conflict
+from core.utils.constants import ACCEPTED, CUSTOMER, DELIVERED, FINISHED_STATUSES, PHARMACIST, RIDER, STATUS_CHANGED_BY
 
 from . import models
+from .notifications import ORDER_CREATED, ORDER_UPDATED, invalidate_tracking, notify_pharmacy
+from .locations import schedule_release
+from .tasks import complete_order, dispatch_order
+from medication.models import PharmacyStock
 from medication.serializers import MedicationSerializer, MinimizedPharmacySerializer
 from core.utils.helpers import generate_random_string, raise_validation_error
 
 
-class ItemsSerializer(serializers.ModelSerializer):
-    
-    class Meta:
-        model = models.OrderItem
-        fields = '__all__'
-        extra_kwargs = {
-            'order': {'read_only':True},
-        }
-
-
 class LocationSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
@@ -41,20 +37,49 @@ class FetchItemsSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class OrderSerializer(serializers.ModelSerializer):
-    items = serializers.ListField(child=ItemsSerializer(), allow_empty=False)
+class OrderItemInputSerializer(serializers.Serializer):
+    """Item of a new order. Medications are resolved in bulk by OrderSerializer."""
+    medication = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1)
+
 
+class OrderSerializer(serializers.ModelSerializer):
+    """
+    Creates an order with its items. Item prices and the total price come
+    from the pharmacy's stock, never from the client.
+    """
+    items = serializers.ListField(child=OrderItemInputSerializer(), allow_empty=False, write_only=True)
+
+    def validate(self, attrs):
+        pharmacy = attrs.get('pharmacy')
+        if pharmacy is None:
+            raise_validation_error({'pharmacy': 'This field is required.'})
+
+        items = attrs['items']
+        prices = dict(
+            PharmacyStock.objects
+            .filter(pharmacy=pharmacy, medication_id__in={item['medication'] for item in items}, in_stock=True, price__isnull=False)
+            .values_list('medication_id', 'price')
+        )
+        unavailable = sorted({item['medication'] for item in items} - prices.keys())
+        if unavailable:
+            raise_validation_error({'items': [f'Medication {medication_id} is not in stock at this pharmacy' for medication_id in unavailable]})
+
+        attrs['items'] = [
+            {'medication_id': item['medication'], 'quantity': item['quantity'], 'price': prices[item['medication']]}
+            for item in items
+        ]
+        attrs['total_price'] = sum(item['price'] * item['quantity'] for item in attrs['items'])
+        return attrs
+
+    @transaction.atomic
     def create(self, validated_data):
         items = validated_data.pop('items')
         validated_data['customer'] = self.context['request'].user
+        validated_data['payment_reference'] = generate_random_string(16)
         instance = self.Meta.model._default_manager.create(**validated_data)
 
-
-        for item in items:
-            item['order'] = instance
-            models.OrderItem._default_manager.create(**item)
-
-        self.fields.pop('items')
+        models.OrderItem.objects.bulk_create([models.OrderItem(order=instance, **item) for item in items])
 
         tracking_id = generate_random_string(12)
         tracking_info = {
@@ -65,12 +90,18 @@ class OrderSerializer(serializers.ModelSerializer):
         }
         
         models.CurrentOrderLocation.objects.create(**tracking_info)
+        notify_pharmacy(instance, ORDER_CREATED)
 
         return instance
     
     class Meta:
         model = models.Order
         fields = '__all__'
+        # Status and version only change through Order.update_status, payment
+        # through the payment webhook.
+        read_only_fields = [
+            'customer', 'total_price', 'status', 'version', 'is_completed', 'rider', 'is_payment_complete', 'payment',
+        ]
 
 
 class ImageUploadSerializer(serializers.ModelSerializer):
@@ -89,6 +120,24 @@ class FetchOrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Order
         fields = '__all__'
+        select_related = ['pharmacy', 'prescription']
+
+
+class PharmacyOrderSerializer(serializers.ModelSerializer):
+    """Order as shown in the pharmacy inbox"""
+
+    customer = UserSerializer()
+    prescription = ImageUploadSerializer()
+    items = FetchItemsSerializer(many=True)
+
+    class Meta:
+        model = models.Order
+        fields = [
+            'id', 'customer', 'status', 'version', 'total_price', 'delivery_fee',
+            'is_payment_complete', 'prescription', 'action_reason', 'items', 'created_at', 'updated_at',
+        ]
+        select_related = ['customer', 'prescription']
+        prefetch_related = ['items__medication']
 
 
 class MinimizedOrderSerializer(serializers.ModelSerializer):
@@ -101,6 +150,14 @@ class MinimizedOrderSerializer(serializers.ModelSerializer):
 
 
 class UpdateOrderSerializer(serializers.ModelSerializer):
+    """
+    Moves the order along core.utils.constants.STATUS_TRANSITIONS, each status
+    being set only by the roles in STATUS_CHANGED_BY. Send the version you last read to make sure nobody changed the order in between.
+    A concurrent change gets a 409 and should be retried after reloading.
+    Earnings and sales counters of a delivered order are recorded in the
+    background by order.tasks.complete_order.
+    """
+    version = serializers.IntegerField(required=False)
 
     def is_valid(self, raise_exception=False):
         # if self.instance is not None and not self.instance.is_payment_complete:
@@ -108,60 +165,71 @@ class UpdateOrderSerializer(serializers.ModelSerializer):
 
         return super().is_valid(raise_exception)
 
-    def save(self, **kwargs):
-        instance =  super().save(**kwargs)
-        if instance.is_completed or instance.status == DELIVERED:
-            try:
-                models.OrderEarning.objects.create(order=instance, 
-                pharmacy=instance.pharmacy, 
-                pharmacy_earning=instance.total_price, rider_earning=50)
-            except IntegrityError:
-                raise_validation_error({'detail': 'Order completed already'})
-            instance.pharmacy.completed_orders += 1
-            instance.pharmacy.save()
-            for item in instance.items.all():
-                item.medication.units_moved += item.quantity
-                item.medication.save()
+    def validate(self, attrs):
+        # is_completed is kept for older clients and means delivered
+        if attrs.pop('is_completed', False):
+            attrs.setdefault('status', DELIVERED)
+
+        version = attrs.pop('version', None)
+        if version is not None and version != self.instance.version:
+            raise Conflict('The order was changed, reload it and try again')
+
+        status = attrs.get('status', self.instance.status)
+        if not self.instance.can_transition(status):
+            raise_validation_error({'status': f'An order cannot go from {self.instance.status} to {status}'})
+        if status != self.instance.status and not self.can_set_status(status):
+            raise PermissionDenied(f'You cannot mark this order as {status}')
+        return attrs
+
+    def can_set_status(self, status):
+        user = self.context['request'].user
+        if user.is_staff:
+            return True
+        roles = set()
+        if user.id == self.instance.customer_id:
+            roles.add(CUSTOMER)
+        if user.id == self.instance.rider_id:
+            roles.add(RIDER)
+        if user.user_type == PHARMACIST and user.pharmacist_profile.pharmacy_id == self.instance.pharmacy_id:
+            roles.add(PHARMACIST)
+        return bool(roles.intersection(STATUS_CHANGED_BY[status]))
+
+    def update(self, instance, validated_data):
+        previous_status = instance.status
+        status = validated_data.get('status', previous_status)
+        updated = instance.update_status(
+            status,
+            action_reason=validated_data.get('action_reason'),
+            changed_by=self.context['request'].user,
+        )
+        if not updated:
+            raise Conflict('The order was changed, reload it and try again')
+
+        notify_pharmacy(instance, ORDER_UPDATED)
+        if status in FINISHED_STATUSES and previous_status != status:
+            invalidate_tracking(instance.pk)
+            transaction.on_commit(lambda: schedule_release(instance.pk))
+        if status == ACCEPTED and previous_status != ACCEPTED and not instance.rider_id:
+            transaction.on_commit(lambda: dispatch_order.delay(instance.pk))
+        if status == DELIVERED and previous_status != DELIVERED:
+            transaction.on_commit(lambda: complete_order.delay(instance.pk))
         return instance
     
     class Meta:
         model = models.Order
-        fields = ['is_completed', 'status', 'action_reason']
+        fields = ['is_completed', 'status', 'action_reason', 'version']
 
 
 class PaymentSerializer(serializers.ModelSerializer):
-
-    def is_valid(self, raise_exception=False):
-
-        if self.initial_data.get('event') == 'charge.completed':
-           data = self.initial_data.get('data')
-           data['event_id'] = data.get('id')
-           customer = data.get('customer')
-           if customer:
-               customer_email = customer.get('email')
-               customer_phone_no = customer.get('phone_number')
-               data['customer_email'] = customer_email
-               data['customer_phone_no'] = customer_phone_no
-               
-
-           self.initial_data = data
-
-        raise_exception=False
-
-        return super().is_valid(raise_exception=raise_exception)
-
-    def save(self, **kwargs):
-        instance =  super().save(**kwargs)
-        order = models.Order.objects.filter(customer__email=instance.customer_email, payment=None).order_by('-id').first()
-        if order:
-            order.payment = instance
-            order.is_payment_complete = True
-            order.save()
-        return instance
+    """Validates the payment of a charge.completed webhook event, see order.tasks.process_payment_events"""
 
     class Meta:
         model = models.Payment
         fields = '__all__'
+        extra_kwargs = {
+            # Events are deduplicated on their id before they get here
+            'event_id': {'validators': []},
+        }
 
 
 class RetrieveOrderSerializer(serializers.ModelSerializer):
@@ -171,10 +239,14 @@ class RetrieveOrderSerializer(serializers.ModelSerializer):
     pharmacy = MinimizedPharmacySerializer()
     customer = UserSerializer()
     rider = UserSerializer()
+    items = FetchItemsSerializer(many=True, read_only=True)
+    tracking_id = serializers.CharField(source='tracking_object.tracking_id', read_only=True)
     
     class Meta:
         model = models.Order
         fields = '__all__'
+        select_related = ['prescription', 'location', 'pharmacy', 'customer', 'rider', 'tracking_object']
+        prefetch_related = ['items__medication']
 
 
 class RiderEarningsSerializer(serializers.ModelSerializer):
@@ -183,7 +255,8 @@ class RiderEarningsSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = models.OrderEarning
-        fields = ['order', 'rider_earning']
+        fields = ['id', 'order', 'rider_earning', 'created_at']
+        select_related = ['order__pharmacy', 'order__prescription']
 
 
 class PharmacyEarningsSerializer(serializers.ModelSerializer):
@@ -192,6 +265,12 @@ class PharmacyEarningsSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = models.OrderEarning
-        fields = ['order', 'pharmacy_earning']
+        fields = ['id', 'order', 'pharmacy_earning', 'created_at']
+        select_related = ['order__customer']
 
-        
\ No newline at end of file
+
+class EarningRollupSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = models.EarningRollup
+        fields = ['period_start', 'earnings', 'orders']
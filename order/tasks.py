@@ -0,0 +1,165 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.utils import timezone
+
+from medzako.celery import app
+from medication.models import Medication, Pharmacy
+
+from core.utils.constants import ACCEPTED
+
+from . import models
+from .notifications import ORDER_UPDATED, notify_pharmacy
+
+RIDER_EARNING = 50
+DISPATCH_RETRY_DELAY = 30
+DISPATCH_MAX_RETRIES = 20
+PAYMENT_EVENT_BATCH_SIZE = 100
+CHARGE_COMPLETED = 'charge.completed'
+SUCCESSFUL = 'successful'
+
+
+@app.task()
+def complete_order(order_id):
+    """
+    Record the earnings of a delivered order and bump the pharmacy's completed
+    orders and each medication's units moved. Safe to run more than once:
+    the earning is unique per order, so a repeat run changes nothing.
+    """
+    order = models.Order.objects.filter(pk=order_id).first()
+    if order is None:
+        return
+
+    quantities = dict(
+        order.items.order_by()
+        .values('medication_id')
+        .annotate(quantity=Sum('quantity'))
+        .values_list('medication_id', 'quantity')
+    )
+    try:
+        with transaction.atomic():
+            models.OrderEarning.objects.create(
+                order=order,
+                pharmacy_id=order.pharmacy_id,
+                rider_id=order.rider_id,
+                pharmacy_earning=order.total_price,
+                rider_earning=RIDER_EARNING,
+            )
+            Pharmacy.objects.filter(pk=order.pharmacy_id).update(completed_orders=F('completed_orders') + 1)
+            if quantities:
+                units = Case(
+                    *[When(pk=medication_id, then=Value(quantity)) for medication_id, quantity in quantities.items()],
+                    default=Value(0),
+                    output_field=IntegerField(),
+                )
+                Medication.objects.filter(pk__in=quantities).update(units_moved=F('units_moved') + units)
+    except IntegrityError:
+        # Completed already
+        return
+
+
+@app.task()
+def process_payment_events(batch_size=PAYMENT_EVENT_BATCH_SIZE):
+    """
+    Turn stored payment webhook events into payments, a batch at a time, and
+    attach each payment to the order whose payment_reference the provider
+    echoed back as tx_ref. Concurrent workers skip each other's batches.
+    """
+    while True:
+        with transaction.atomic():
+            events = list(
+                models.PaymentEvent.objects
+                .select_for_update(skip_locked=True)
+                .filter(processed_at__isnull=True)
+                .order_by('id')[:batch_size]
+            )
+            if not events:
+                return
+            process_payment_event_batch(events)
+
+
+def get_payment_data(payload):
+    data = dict(payload.get('data') or {})
+    customer = data.get('customer') or {}
+    data['event_id'] = data.get('id')
+    data['customer_email'] = customer.get('email')
+    data['customer_phone_no'] = customer.get('phone_number')
+    return data
+
+
+def process_payment_event_batch(events):
+    from .serializers import PaymentSerializer
+
+    payments = {}
+    for event in events:
+        if event.event != CHARGE_COMPLETED:
+            continue
+        serializer = PaymentSerializer(data=get_payment_data(event.payload))
+        if not serializer.is_valid():
+            event.error = str(serializer.errors)
+            continue
+        payments[event] = models.Payment(**serializer.validated_data)
+
+    models.Payment.objects.bulk_create(payments.values(), ignore_conflicts=True)
+    payment_ids = dict(models.Payment.objects.filter(event_id__in=[event.event_id for event in payments]).values_list('event_id', 'id'))
+
+    # Only successful charges settle an order, so a failed attempt leaves it
+    # open for the customer's retry.
+    references = {event.payload['data'].get('tx_ref') for event, payment in payments.items() if payment.status == SUCCESSFUL}
+    orders = models.Order.objects.filter(payment_reference__in=references, is_payment_complete=False).in_bulk(field_name='payment_reference')
+    now = timezone.now()
+    paid = []
+    for event, payment in payments.items():
+        if payment.status != SUCCESSFUL:
+            event.error = f'Charge was not successful: {payment.status}'
+            continue
+        order = orders.get(event.payload['data'].get('tx_ref'))
+        if order is None:
+            event.error = 'No unpaid order with this tx_ref'
+            continue
+        if payment.charged_amount < order.total_price + order.delivery_fee:
+            event.error = f'Charged {payment.charged_amount}, the order costs {order.total_price + order.delivery_fee}'
+            continue
+        del orders[order.payment_reference]
+        order.payment_id = payment_ids[event.event_id]
+        order.is_payment_complete = True
+        order.updated_at = now
+        paid.append(order)
+    models.Order.objects.bulk_update(paid, ['payment', 'is_payment_complete', 'updated_at'])
+
+    for event in events:
+        event.processed_at = now
+    models.PaymentEvent.objects.bulk_update(events, ['processed_at', 'error'])
+    for order in paid:
+        notify_pharmacy(order, ORDER_UPDATED)
+
+
+@app.task(bind=True, max_retries=DISPATCH_MAX_RETRIES, default_retry_delay=DISPATCH_RETRY_DELAY)
+def dispatch_order(self, order_id):
+    """Assign the nearest available rider to an accepted order, retrying while none is available."""
+    from .dispatch import assign_rider
+
+    order = models.Order.objects.select_related('pharmacy').filter(pk=order_id).first()
+    if order is None or order.rider_id or order.status != ACCEPTED or order.pharmacy is None:
+        return None
+
+    assigned = assign_rider(order)
+    if assigned is None:
+        raise self.retry()
+    notify_pharmacy(order, ORDER_UPDATED)
+    return assigned[0]
+
+
+@app.task()
+def flush_order_locations():
+    """Periodically write the buffered rider locations to the database, see order.locations."""
+    from .locations import flush_locations
+
+    return flush_locations()
+
+
+@app.task()
+def release_order_location(order_id):
+    """Drop a finished order's location from the buffer, see order.locations.release_location."""
+    from .locations import release_location
+
+    release_location(order_id)
@@ -0,0 +1,106 @@
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from authentication.models import User
+from core.utils.constants import RECEIVED
+from medication.models import Medication, Pharmacy, PharmacyStock
+from .models import Location, Order, Payment
+
+
+class CreateOrderTests(TestCase):
+
+    def setUp(self):
+        self.customer = User.objects.create_user(
+            first_name='Jane', second_name='Doe', password='Str0ng!Passw0rd',
+            phone_no='254700000001', email='customer@example.com', user_type='customer',
+        )
+        self.pharmacy = Pharmacy.objects.create(
+            name='Pharmacy', location_lat='-1.28', location_long='36.82', contact_no='254700000002',
+        )
+        medication = Medication.objects.create(name='Paracetamol', type='OTC')
+        PharmacyStock.objects.create(medication=medication, pharmacy=self.pharmacy, price='10.00', in_stock=True)
+        self.location = Location.objects.create(customer=self.customer, lat='-1.29', long='36.83', general_area='CBD')
+        self.medication = medication
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def test_create_ignores_status_and_version(self):
+        response = self.client.post('/api/orders/', {
+            'pharmacy': self.pharmacy.id,
+            'location': self.location.id,
+            'delivery_fee': '100.00',
+            'items': [{'medication': self.medication.id, 'quantity': 2}],
+            'status': 'delivered',
+            'version': 77,
+            'is_completed': True,
+            'is_payment_complete': True,
+        }, format='json')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        order = Order.objects.get()
+        self.assertEqual(order.status, RECEIVED)
+        self.assertEqual(order.version, 0)
+        self.assertFalse(order.is_completed)
+        self.assertFalse(order.is_payment_complete)
+
+    def test_create_ignores_payment(self):
+        payment = Payment.objects.create(
+            amount='120.00', payment_type='card', event_id='event', charged_amount='120.00',
+            customer_email='other@example.com', customer_phone_no='254700000003', status='successful',
+        )
+        response = self.client.post('/api/orders/', {
+            'pharmacy': self.pharmacy.id,
+            'location': self.location.id,
+            'delivery_fee': '100.00',
+            'items': [{'medication': self.medication.id, 'quantity': 2}],
+            'payment': payment.id,
+        }, format='json')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertIsNone(Order.objects.get().payment_id)
+
+
+class UpdateOrderStatusTests(TestCase):
+
+    def setUp(self):
+        self.customer = User.objects.create_user(
+            first_name='Jane', second_name='Doe', password='Str0ng!Passw0rd',
+            phone_no='254700000001', email='customer@example.com', user_type='customer',
+        )
+        self.stranger = User.objects.create_user(
+            first_name='John', second_name='Doe', password='Str0ng!Passw0rd',
+            phone_no='254700000004', email='stranger@example.com', user_type='customer',
+        )
+        self.pharmacist = User.objects.create_user(
+            first_name='Phil', second_name='Doe', password='Str0ng!Passw0rd',
+            phone_no='254700000005', email='pharmacist@example.com', user_type='pharmacist',
+        )
+        pharmacy = Pharmacy.objects.create(
+            name='Pharmacy', location_lat='-1.28', location_long='36.82', contact_no='254700000002',
+        )
+        self.pharmacist.pharmacist_profile.pharmacy = pharmacy
+        self.pharmacist.pharmacist_profile.save()
+        location = Location.objects.create(customer=self.customer, lat='-1.29', long='36.83', general_area='CBD')
+        self.order = Order.objects.create(
+            customer=self.customer, pharmacy=pharmacy, location=location, total_price='20.00', delivery_fee='100.00',
+        )
+        self.client = APIClient()
+
+    def patch_status(self, user, status):
+        self.client.force_authenticate(user)
+        return self.client.patch(f'/api/orders/{self.order.id}/', {'status': status}, format='json')
+
+    def test_customer_cannot_accept(self):
+        self.assertEqual(self.patch_status(self.customer, 'accepted').status_code, 403)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, RECEIVED)
+
+    def test_customer_can_cancel(self):
+        self.assertEqual(self.patch_status(self.customer, 'canceled').status_code, 200)
+
+    def test_pharmacist_can_accept(self):
+        self.assertEqual(self.patch_status(self.pharmacist, 'accepted').status_code, 200)
+
+    def test_other_users_cannot_see_the_order(self):
+        self.assertEqual(self.patch_status(self.stranger, 'canceled').status_code, 404)
@@ -0,0 +1,71 @@
+import time
+
+from core.utils.constants import EQUIRECTANGULAR
+from core.utils.distance import batch_distance
+
+DEFAULT_COALESCE_WINDOW = 1
+DEFAULT_MIN_DISTANCE = 0.005
+DEFAULT_RATE_LIMIT = 5
+DEFAULT_BURST = 10
+
+
+class TokenBucket:
+    """Allows `rate` events per second on average, in bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def consume(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class LocationCoalescer:
+    """
+    Decides which of a rider's location fixes are forwarded. At most one fix
+    is forwarded per window: fixes arriving within it replace each other and
+    only the newest is forwarded when it closes. A fix less than min_distance
+    km from the last forwarded one is dropped, so a rider standing still
+    sends nothing.
+    """
+
+    def __init__(self, window, min_distance):
+        self.window = window
+        self.min_distance = min_distance
+        self.last = None
+        self.last_at = float('-inf')
+        self.pending = None
+
+    def offer(self, lat, long):
+        """
+        Return 0 to forward the fix now, the seconds until it is due when it
+        is held as pending, or None when it is dropped.
+        """
+        now = time.monotonic()
+        if self.last is not None and batch_distance(self.last, [(lat, long)], mode=EQUIRECTANGULAR)[0] < self.min_distance:
+            self.pending = None
+            return None
+        if now - self.last_at >= self.window:
+            self.mark_forwarded(lat, long, now)
+            return 0
+        self.pending = (lat, long)
+        return self.last_at + self.window - now
+
+    def pop_pending(self):
+        """Return the pending fix, now forwarded, or None."""
+        fix, self.pending = self.pending, None
+        if fix is not None:
+            self.mark_forwarded(*fix, time.monotonic())
+        return fix
+
+    def mark_forwarded(self, lat, long, now):
+        self.last = (lat, long)
+        self.last_at = now
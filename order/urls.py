@@ -5,6 +5,7 @@ app_name = "order"
 
 urlpatterns = [
     path("", views.CreateListOrdersView.as_view(), name="create_list_orders"),
+    path("pharmacy/", views.PharmacyOrdersView.as_view(), name="pharmacy_orders"),
     path("<int:pk>/", views.RetrieveUpdateOrder.as_view(), name="retrieve_order"),
     path("locations/", views.CreateListLocationsView.as_view(), name="create_location"),
     path("locations/<int:pk>/", views.RetrieveUpdateLocation.as_view(), name="retrieve_update_location"),
@@ -12,4 +13,6 @@ urlpatterns = [
     path("image/<int:pk>/", views.DeleteimageView.as_view(), name="delete_image"),
     path("payment-webhook/", views.PaymentView.as_view(), name="payment_webhook"),
     path("earnings/", views.FetchEarningsView.as_view(), name="fetch_earnings"),
+    path("export/<str:dataset>/", views.ExportView.as_view(), name="export"),
+    path("earnings/summary/", views.EarningsSummaryView.as_view(), name="earnings_summary"),
 ]
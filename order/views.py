@@ -1,28 +1,45 @@
+from decimal import Decimal
+
 from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
+from django.db.models import Q
 from django.db.models.query import QuerySet
+from django.http import StreamingHttpResponse
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 
 from rest_framework import generics
+from rest_framework.exceptions import NotFound, PermissionDenied
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 
-from core.permissions import IsRider
-from core.utils.constants import PHARMACIST, RIDER
-from core.utils.helpers import raise_validation_error
+from core.pagination import KeysetPagination
+from core.permissions import IsPharmacist, IsRider
+from core.utils.constants import DAILY, PHARMACIST, RIDER, WEEKLY
+from core.utils.helpers import get_date_range, optimize_queryset, raise_validation_error
 
-from . import models, serializers
+from . import exports, models, serializers
+from .idempotency import IdempotentCreateMixin
+from .tasks import process_payment_events
 
 
-class CreateListOrdersView(generics.ListCreateAPIView):
-    """Creates and List Orders. Use ?status=<status> or is_complete=<boolean> to filter the orders"""
+class CreateListOrdersView(IdempotentCreateMixin, generics.ListCreateAPIView):
+    """
+    Creates and List Orders. Use ?status=<status> or is_complete=<boolean> to filter the orders
+    Listed newest first a page at a time. Follow the `next` link for the following page.
+    Send an Idempotency-Key header with POSTs so retries do not create duplicate orders.
+    """
     permission_classes = [IsAuthenticated]
     queryset = models.Order.objects.all()
     serializer_class = serializers.OrderSerializer
     filterset_fields = ('status', 'is_completed')
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        return self.request.user.orders.all()
+        queryset = self.request.user.orders.all()
+        if self.request.method == 'GET':
+            queryset = optimize_queryset(queryset, serializers.FetchOrderSerializer)
+        return queryset
 
     def get_serializer(self, *args, **kwargs):
 
@@ -43,20 +60,47 @@ class CreateListOrdersView(generics.ListCreateAPIView):
         return Response(serializer.data)
 
 
+class PharmacyOrdersView(generics.ListAPIView):
+    """
+    Orders placed with the pharmacist's pharmacy, newest first. Use ?status=<status> to filter.
+    Follow the `next` link for the following page. Connect to ws/pharmacy-orders/<pharmacy id>
+    to have new and changed orders pushed instead of polling.
+    """
+    permission_classes = [IsPharmacist]
+    serializer_class = serializers.PharmacyOrderSerializer
+    filterset_fields = ('status',)
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        pharmacy_id = self.request.user.pharmacist_profile.pharmacy_id
+        if not pharmacy_id:
+            raise_validation_error({"detail": "Create pharmacy first"})
+        queryset = models.Order.objects.filter(pharmacy_id=pharmacy_id)
+        return optimize_queryset(queryset, self.serializer_class)
+
+
 class RetrieveUpdateOrder(generics.RetrieveUpdateAPIView):
-    """Retrieve and Update Order"""
+    """Retrieve and Update Order. Limited to the order's customer, rider and pharmacists"""
     permission_classes = [IsAuthenticated]
     queryset = models.Order.objects.all()
     serializer_class = serializers.UpdateOrderSerializer
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user = self.request.user
+        if not user.is_staff:
+            participants = Q(customer=user) | Q(rider=user)
+            if user.user_type == PHARMACIST and user.pharmacist_profile.pharmacy_id:
+                participants |= Q(pharmacy_id=user.pharmacist_profile.pharmacy_id)
+            queryset = queryset.filter(participants)
+        if self.request.method == 'GET':
+            queryset = optimize_queryset(queryset, serializers.RetrieveOrderSerializer)
+        return queryset
+
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
         serializer = serializers.RetrieveOrderSerializer(instance)
-        data = serializer.data
-        items_serializer = serializers.FetchItemsSerializer(instance.items.all(), many=True)
-        data['items'] =  items_serializer.data
-        data['tracking_id'] = instance.tracking_object.tracking_id
-        return Response(data=data)
+        return Response(data=serializer.data)
 
     
 class CreateListLocationsView(generics.ListCreateAPIView):
@@ -95,39 +139,145 @@ class DeleteimageView(generics.DestroyAPIView):
     queryset = models.Image.objects.all()
 
 
-class FetchEarningsView(generics.GenericAPIView):
-    """Fetch user earnings"""
+def get_earnings_owner(user):
+    """Filter selecting the earnings of the user's pharmacy or, for riders, their own."""
+    if user.user_type == RIDER:
+        return {'rider': user}
+    if user.user_type == PHARMACIST:
+        pharmacy_id = user.pharmacist_profile.pharmacy_id
+        if pharmacy_id is None:
+            raise_validation_error({"detail": "Create pharmacy first"})
+        return {'pharmacy_id': pharmacy_id}
+    raise_validation_error({'detail': 'Your user type does not have earnings'})
+
+
+class FetchEarningsView(generics.ListAPIView):
+    """
+    Fetch user earnings order by order, newest first. Follow the `next` link for the following page.
+    query parameters:
+        - from (YYYY-MM-DD)
+        - to (YYYY-MM-DD)
+    """
 
     permission_classes = [IsAuthenticated]
-    queryset = QuerySet()
-    serializer_class = serializers.PharmacyEarningsSerializer
+    pagination_class = KeysetPagination
+    filter_backends = []
 
-    def get(self, request, *args, **kwargs):
-        queryset = super().get_queryset()
-        if request.user.user_type == RIDER:
-            queryset = request.rider_earnings
-            serializer = serializers.RiderEarningsSerializer(queryset, many=True)
-        elif request.user.user_type == PHARMACIST:
-            queryset = request.user.pharmacist_profile.pharmacy.pharmacy_earnings
-            serializer = serializers.PharmacyEarningsSerializer(queryset, many=True)
+    def get_serializer_class(self):
+        if self.request.user.user_type == RIDER:
+            return serializers.RiderEarningsSerializer
+        return serializers.PharmacyEarningsSerializer
+
+    def get_queryset(self):
+        queryset = models.OrderEarning.objects.filter(**get_earnings_owner(self.request.user))
+        start, end = get_date_range(self.request.query_params)
+        if start:
+            queryset = queryset.filter(created_at__date__gte=start)
+        if end:
+            queryset = queryset.filter(created_at__date__lte=end)
+        return optimize_queryset(queryset, self.get_serializer_class())
+
+
+class EarningsSummaryView(generics.ListAPIView):
+    """
+    Earnings and number of orders per day or week (starting on Monday), with the totals.
+    query parameters:
+        - period (daily, weekly)
+        - from (YYYY-MM-DD)
+        - to (YYYY-MM-DD)
+    """
+
+    permission_classes = [IsAuthenticated]
+    serializer_class = serializers.EarningRollupSerializer
+    filter_backends = []
+
+    def get_period(self):
+        period = self.request.query_params.get('period', DAILY)
+        if period not in (DAILY, WEEKLY):
+            raise_validation_error({'period': f'Invalid period {period}'})
+        return period
+
+    def get_queryset(self):
+        period = self.get_period()
+        queryset = models.EarningRollup.objects.filter(period=period, **get_earnings_owner(self.request.user))
+        start, end = get_date_range(self.request.query_params)
+        if start:
+            queryset = queryset.filter(period_start__gte=models.get_period_start(start, period))
+        if end:
+            queryset = queryset.filter(period_start__lte=end)
+        return queryset.order_by('period_start')
+
+    def list(self, request, *args, **kwargs):
+        rollups = list(self.get_queryset())
+        return Response({
+            'period': self.get_period(),
+            'earnings': str(sum((rollup.earnings for rollup in rollups), Decimal('0.00'))),
+            'orders': sum(rollup.orders for rollup in rollups),
+            'results': self.get_serializer(rollups, many=True).data,
+        })
+
+
+class ExportView(generics.GenericAPIView):
+    """
+    Stream a full export of orders, order-items or earnings, oldest first.
+    Pharmacists get their pharmacy's rows, admins get every row.
+    query parameters:
+        - output (csv, jsonl)
+        - gzip (true to compress)
+        - from (YYYY-MM-DD)
+        - to (YYYY-MM-DD)
+    """
+
+    permission_classes = [IsAuthenticated]
+    filter_backends = []
+
+    def get_pharmacy_id(self):
+        user = self.request.user
+        if user.is_staff:
+            return None
+        if user.user_type == PHARMACIST and user.pharmacist_profile.pharmacy_id:
+            return user.pharmacist_profile.pharmacy_id
+        raise PermissionDenied()
+
+    def get(self, request, dataset, *args, **kwargs):
+        if dataset not in exports.EXPORTS:
+            raise NotFound(f'Unknown export {dataset}')
+        output = request.query_params.get('output', exports.CSV)
+        if output not in exports.CONTENT_TYPES:
+            raise_validation_error({'output': f'Invalid output {output}'})
+        compress = request.query_params.get('gzip') in ('1', 'true')
+        start, end = get_date_range(request.query_params)
+
+        stream = exports.stream_export(
+            dataset, output, compress,
+            pharmacy_id=self.get_pharmacy_id(), start=start, end=end,
+        )
+        filename = f'{dataset}.{output}'
+        if compress:
+            response = StreamingHttpResponse(stream, content_type='application/gzip')
+            filename += '.gz'
         else:
-            raise_validation_error({'detail': 'Your user type does not have earnings'})
-        return Response(serializer.data)
+            response = StreamingHttpResponse(stream, content_type=exports.CONTENT_TYPES[output])
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
 
 
 @method_decorator(csrf_exempt, name='dispatch')
-class PaymentView(generics.ListCreateAPIView):
-    """Payment Web hook"""
+class PaymentView(generics.CreateAPIView):
+    """
+    Payment Web hook. The event is stored and acknowledged straight away and
+    processed in the background. Events are deduplicated on their id.
+    """
 
     permission_classes = []
-    serializer_class = serializers.PaymentSerializer
+    queryset = models.PaymentEvent.objects.all()
 
     def create(self, request, *args, **kwargs):
-        try:
-            super().create(request, *args, **kwargs)
-        except AssertionError as e:
-            print(e)
-            pass
-        
+        payload = request.data
+        data = payload.get('data') if isinstance(payload, dict) else None
+        if isinstance(data, dict) and data.get('id') is not None:
+            event = models.PaymentEvent(event_id=str(data['id']), event=str(payload.get('event', '')), payload=payload)
+            self.get_queryset().bulk_create([event], ignore_conflicts=True)
+            transaction.on_commit(process_payment_events.delay)
+
         return Response({})
-    
\ No newline at end of file